@@ -0,0 +1,166 @@
+import asyncio
+import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from main import export_site, get_job_store
+from git_publisher import GitBatch
+from pipeline import deploy_job, run_step
+from job_store import WECHAT_MEDIA_ID, WECHAT_REQUESTED
+from wechat_client import MAX_ARTICLES_PER_DRAFT
+
+DEFAULT_LIMITS = {"deepseek": 4, "gemini": 2}
+
+
+def load_jobs(path, default_style="psychology"):
+    """读取 JSONL 任务文件，每行一个 {title, angle, style, date}"""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                job = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"跳过第 {lineno} 行: JSON 解析失败 ({e})")
+                continue
+            if not job.get("title") or not job.get("angle"):
+                print(f"跳过第 {lineno} 行: 缺少 title 或 angle")
+                continue
+            job.setdefault("style", default_style)
+            job.setdefault("date", "")
+            jobs.append(job)
+    return jobs
+
+
+class _Throttled:
+    """按 Provider 信号量限制同时在途的 LLM 请求；步骤在线程中运行，分节审查的每一节也各占一个名额"""
+
+    def __init__(self, llm, semaphore):
+        self.llm = llm
+        self.semaphore = semaphore
+        self.provider = llm.provider
+        self.model = llm.model
+
+    def generate(self, *args, **kwargs):
+        with self.semaphore:
+            return self.llm.generate(*args, **kwargs)
+
+    def generate_to_file(self, *args, **kwargs):
+        with self.semaphore:
+            return self.llm.generate_to_file(*args, **kwargs)
+
+
+class BatchRunner:
+    """在 asyncio 上并发运行多篇文章的生成流程，按 Provider 限制同时在途的请求数"""
+
+    def __init__(self, llm, prompt_manager, limits=None, keep_existing=True, stream=False, fast_import=False,
+                 wechat=None, section_review=False, conversation=False):
+        self.pm = prompt_manager
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        # ProviderScheduler 的 provider 为 None：并发由其下各后端的限流控制
+        if llm.provider is None:
+            self.llm = llm
+        else:
+            self.llm = _Throttled(llm, threading.BoundedSemaphore(self.limits.get(llm.provider, 1)))
+        self.keep_existing = keep_existing
+        self.stream = stream
+        self.fast_import = fast_import
+        self.wechat = wechat
+        self.section_review = section_review
+        self.conversation = conversation
+        self._wechat_articles = []
+        self._git_batch = None
+        self._deploy_lock = threading.Lock()
+        self._job_ids = []
+
+    async def run_article(self, job):
+        """把一个已登记到 jobs.db 的任务从其最后完成的步骤推进到 deployed"""
+        store = get_job_store()
+        try:
+            return await self._advance(store, job)
+        except Exception as e:
+            store.fail(job["id"], e)
+            raise
+
+    async def _advance(self, store, job):
+        title = job["title"]
+        prompts = self.pm.prompts[job["style"]]
+        if self.wechat and WECHAT_REQUESTED not in job["outputs"]:
+            store.save_output(job["id"], WECHAT_REQUESTED, "1")
+        max_workers = self.limits.get(self.llm.provider) or sum(self.limits.values())
+        while job["state"] != "deployed":
+            # 每一步（LLM 调用、渲染、部署）都在线程中执行，与 cli_generate.run_job 共用 pipeline.run_step
+            state, outputs = await asyncio.to_thread(
+                run_step, job, self.llm, prompts, self.stream, self.section_review, max_workers, self.conversation,
+                self._deploy, lambda message: print(f"[{title}] {message.strip()}"))
+            store.advance(job["id"], state, **outputs)
+            job = store.get(job["id"])
+
+        if WECHAT_MEDIA_ID not in job["outputs"]:
+            if self.wechat:
+                self._wechat_articles.append((job["id"], self.wechat.build_article(
+                    title, job["outputs"]["wechat_html"], thumb_media_id=os.getenv("WECHAT_THUMB_MEDIA_ID", ""))))
+            elif WECHAT_REQUESTED in job["outputs"]:
+                print(f"[{title}] 公众号草稿尚未上传，可加 --wechat-draft 续跑补传")
+        print(f"[{title}] 完成")
+        return title
+
+    def _deploy(self, job):
+        # 写文件、更新 manifest 和 git 提交都不是并发安全的，逐篇串行执行；
+        # 写入与登记都是幂等的，部署中途中断后重跑不会产生重复条目
+        with self._deploy_lock:
+            # --no-keep 记在批次内每个任务上，只由最先部署的一篇清空 manifest，否则每篇都会清掉同批次前面的文章。
+            # 清空并部署完成后才改回保留，中途中断时续跑仍按原批次的设置清空一次，且不会清掉本批已部署的文章
+            store = get_job_store()
+            clearing = store.clearing(self._job_ids)
+            deploy_job(job, not clearing, export=False, batch=self._git_batch)
+            store.set_keep_existing(clearing)
+
+    def _upload_wechat(self):
+        """全部文章合并为多图文草稿（正文图片并发上传），并把 media_id 记到各任务上，续跑时不重复上传"""
+        job_ids = [job_id for job_id, _ in self._wechat_articles]
+        media_ids = self.wechat.upload_drafts([article for _, article in self._wechat_articles])
+        store = get_job_store()
+        for i, media_id in enumerate(media_ids):
+            if media_id:
+                for job_id in job_ids[i * MAX_ARTICLES_PER_DRAFT:(i + 1) * MAX_ARTICLES_PER_DRAFT]:
+                    store.save_output(job_id, WECHAT_MEDIA_ID, media_id)
+
+    async def run(self, jobs):
+        workers = sum(self.limits.values()) + 2
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=workers))
+
+        for job in jobs:
+            if job["style"] not in self.pm.prompts:
+                raise ValueError(f"Style {job['style']} not found (job: {job['title']})")
+        # 新任务先登记到 jobs.db，批次的 keep_existing 随任务保存，续跑时沿用原批次的设置
+        store = get_job_store()
+        jobs = [job if "id" in job else store.create(job["title"], job["angle"], job["style"], job["date"],
+                                                     self.keep_existing)
+                for job in jobs]
+        self._job_ids = [job["id"] for job in jobs]
+
+        # 整批只导出一次 manifest / index.html，只做一次 git 提交
+        with GitBatch(f"Add {len(jobs)} articles", fast_import=self.fast_import) as git_batch:
+            self._git_batch = git_batch
+            results = await asyncio.gather(*(self.run_article(job) for job in jobs), return_exceptions=True)
+            git_batch.add(*export_site())
+        if self.wechat and self._wechat_articles:
+            await asyncio.to_thread(self._upload_wechat)
+        failed = [(job, r) for job, r in zip(jobs, results) if isinstance(r, BaseException)]
+        for job, err in failed:
+            print(f"[{job['title']}] 失败: {err}")
+        print(f"--- 批量任务完成: 成功 {len(jobs) - len(failed)} / {len(jobs)} ---")
+        if failed:
+            print("已完成的阶段已保存在 jobs.db，可使用 python cli_generate.py --resume 从中断处继续")
+        return failed
+
+
+def run_batch(jobs, llm, prompt_manager, limits=None, keep_existing=True, stream=False, fast_import=False, wechat=None,
+              section_review=False, conversation=False):
+    runner = BatchRunner(llm, prompt_manager, limits, keep_existing, stream, fast_import, wechat, section_review,
+                         conversation)
+    return asyncio.run(runner.run(jobs))
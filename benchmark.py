@@ -0,0 +1,315 @@
+"""离线基准测试：用本地 mock 服务替代 DeepSeek / Gemini / 微信接口，测量生成、发布与门户导出的耗时
+
+    python benchmark.py                 # 全部场景，结果写入 bench_results/<时间戳>.json
+    python benchmark.py --quick         # 减少轮数与规模，适合改动后快速对比
+    python benchmark.py --only manifest --latency 0.05 --error-rate 0.1
+    python benchmark.py --only conversation   # 对话模式与单轮请求的前缀缓存命中对比
+
+每次运行都会与 bench_results/ 下最近一次参数相同的结果逐项对比，耗时上升超过 --threshold 的指标会被标出。
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+from mock_server import MockConfig, MockServer
+
+RESULTS_DIR = "bench_results"
+PROMPTS_DIR = os.path.abspath("prompts")
+BENCH_STYLE = "psychology"
+SCENARIOS = ("single", "batch", "conversation", "manifest")
+# 命中缓存的输入 token 相对未命中的计费比例（DeepSeek 现行价约为 0.1 倍），用于折算 conversation 场景的输入费用
+CACHE_HIT_PRICE = 0.1
+
+
+def _stats(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "mean": round(statistics.mean(samples), 4),
+        "p50": round(samples[len(samples) // 2], 4),
+        "p95": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 4),
+    }
+
+
+def _make_client(provider, url):
+    from llm_client import DeepSeekClient, GeminiClient
+    cls = DeepSeekClient if provider == "deepseek" else GeminiClient
+    # 关闭限流和缓存，只测客户端与流程本身的开销
+    return cls("bench-key", base_url=url, cache_mode="bypass", max_retries=5)
+
+
+def _workspace(root, name):
+    """每个场景一个独立的 git 仓库，发布流程的相对路径（index.html、articles.db 等）都落在这里
+
+    main 中按当前目录打开的单例（manifest、查重索引、任务库）一并关闭重置，下一个场景不会读到上一个工作区的数据库。
+    """
+    import main
+    path = os.path.join(root, name)
+    os.makedirs(path)
+    os.chdir(path)
+    subprocess.run(["git", "init", "-q"], check=True)
+    subprocess.run(["git", "config", "user.email", "bench@localhost"], check=True)
+    subprocess.run(["git", "config", "user.name", "bench"], check=True)
+    for name in ("_dedup_index", "_manifest_store", "_job_store"):
+        if getattr(main, name) is not None:
+            getattr(main, name).close()
+        setattr(main, name, None)
+    return path
+
+
+def bench_single(url, rounds):
+    """单篇文章的端到端延迟：Stage 2-4、渲染与部署（run_job），非流式与流式（含首 token 时间）各跑 rounds 篇"""
+    from cli_generate import run_job
+    from main import get_job_store
+    from metrics import recorder
+    from prompt_templates import PromptManager
+    prompts = PromptManager(PROMPTS_DIR).prompts[BENCH_STYLE]
+    store = get_job_store()
+    results = {}
+    for provider in ("deepseek", "gemini"):
+        llm = _make_client(provider, url)
+        results[provider] = {}
+        for mode in ("article", "stream"):
+            totals, ttft, failed = [], [], 0
+            for i in range(rounds):
+                job = store.create(f"单篇基准 {provider}-{mode}-{i}", "压测", BENCH_STYLE, "2024-01-01")
+                first_event = len(recorder.events)
+                start = time.monotonic()
+                try:
+                    run_job(store, job, llm, prompts, stream=mode == "stream", log=lambda message: None)
+                except Exception as e:
+                    # --error-rate 较高时重试也可能耗尽，记为失败，不计入延迟
+                    print(f"  {provider} {mode} #{i} 失败: {e}")
+                    failed += 1
+                    continue
+                totals.append(time.monotonic() - start)
+                # 首 token 时间取 Stage 2（文章的第一个 LLM 调用）
+                ttft += [e["ttft"] for e in recorder.events[first_event:]
+                         if e["kind"] == "llm" and e.get("stage") == "Stage 2" and e.get("ttft") is not None]
+            results[provider][mode] = dict(_stats(totals) if totals else {}, failed=failed)
+            if ttft:
+                results[provider]["ttft"] = _stats(ttft)
+        print(f"  {provider}: 单篇 p50 {results[provider]['article'].get('p50')}s, "
+              f"流式 p50 {results[provider]['stream'].get('p50')}s")
+    return results
+
+
+def bench_batch(url, root, levels, articles):
+    """批量生成的吞吐量：同一批文章在不同并发度下的总耗时（含上传微信草稿）"""
+    from batch import BatchRunner
+    from prompt_templates import PromptManager
+    from wechat_client import WeChatClient
+    pm = PromptManager(PROMPTS_DIR)
+    results = {}
+    for level in levels:
+        _workspace(root, f"batch-{level}")
+        jobs = [{"title": f"基准测试文章 {level}-{i}", "angle": "压测", "style": BENCH_STYLE, "date": "2024-01-01"}
+                for i in range(articles)]
+        wechat = WeChatClient("bench-app", "bench-secret", base_url=url)
+        runner = BatchRunner(_make_client("deepseek", url), pm, limits={"deepseek": level}, wechat=wechat)
+        start = time.monotonic()
+        failed = asyncio.run(runner.run(jobs))
+        elapsed = time.monotonic() - start
+        results[str(level)] = {
+            "articles": articles,
+            "failed": len(failed),
+            "seconds": round(elapsed, 4),
+            "articles_per_sec": round(articles / elapsed, 3),
+        }
+        print(f"  concurrency {level}: {articles} 篇 {elapsed:.2f}s ({articles / elapsed:.2f} 篇/s)")
+    return results
+
+
+def bench_conversation(url, root, articles):
+    """同一批文章分别以逐阶段单轮请求和对话模式生成，对比输入 token 中命中前缀缓存（mock 模拟）的部分"""
+    from cli_generate import run_job
+    from main import get_job_store
+    from metrics import recorder
+    from prompt_templates import PromptManager
+    prompts = PromptManager(PROMPTS_DIR).prompts[BENCH_STYLE]
+    results = {}
+    for mode in ("single_turn", "conversation"):
+        _workspace(root, f"conversation-{mode}")
+        store = get_job_store()
+        llm = _make_client("deepseek", url)
+        first_event = len(recorder.events)
+        start = time.monotonic()
+        for i in range(articles):
+            job = store.create(f"对话模式基准 {mode}-{i}", "压测", BENCH_STYLE, "2024-01-01")
+            run_job(store, job, llm, prompts, log=lambda message: None, conversation=mode == "conversation")
+        elapsed = time.monotonic() - start
+        calls = [e for e in recorder.events[first_event:] if e["kind"] == "llm"]
+        prompt_tokens = sum(e.get("prompt_tokens") or 0 for e in calls)
+        cached = sum(e.get("cached_tokens") or 0 for e in calls)
+        billed = round(prompt_tokens - cached + cached * CACHE_HIT_PRICE)
+        results[mode] = {
+            "articles": articles,
+            "seconds": round(elapsed, 4),
+            "prompt_tokens": prompt_tokens,
+            "cached_tokens": cached,
+            "uncached_tokens": prompt_tokens - cached,
+            "billed_tokens": billed,
+        }
+        print(f"  {mode}: 输入 {prompt_tokens} tokens，命中缓存 {cached} ({cached / max(prompt_tokens, 1):.0%})，"
+              f"未命中 {prompt_tokens - cached}")
+        print(f"  {mode}: 折算输入费用 {billed} 个未命中 token（命中按 {CACHE_HIT_PRICE} 倍计）")
+    single, chat = results["single_turn"]["billed_tokens"], results["conversation"]["billed_tokens"]
+    print(f"  对话模式输入费用为单轮请求的 {chat / max(single, 1):.2f} 倍")
+    return results
+
+
+def bench_manifest(root, sizes):
+    """存档规模对 update_manifest / 门户导出的影响
+
+    dedup_build 为已有存档首次建查重索引的耗时（交互流程中在启动时后台进行），
+    之后的 update_manifest 只包含登记新文章与增量同步索引。
+    """
+    import main
+    results = {}
+    for size in sizes:
+        _workspace(root, f"manifest-{size}")
+        store = main.get_manifest_store()
+        base = datetime.date(2015, 1, 1)
+        with store.lock, store.conn:
+            store.conn.executemany(
+                "INSERT INTO articles (url, title, date) VALUES (?, ?, ?)",
+                ((f"article-{i}.html", f"存档文章 {i} 心理学与自我成长",
+                  (base + datetime.timedelta(days=i % 3650)).isoformat()) for i in range(size)),
+            )
+        timings = {}
+        start = time.monotonic()
+        main.get_dedup_index().sync()
+        timings["dedup_build"] = round(time.monotonic() - start, 4)
+        start = time.monotonic()
+        main.update_manifest("新文章", "new-article.html", "2025-01-01")
+        timings["update_manifest"] = round(time.monotonic() - start, 4)
+        start = time.monotonic()
+        main.generate_index_html()
+        timings["generate_index_html"] = round(time.monotonic() - start, 4)
+        start = time.monotonic()
+        main.export_site()
+        timings["export_site"] = round(time.monotonic() - start, 4)
+        results[str(size)] = timings
+        print(f"  {size} 篇: " + ", ".join(f"{k} {v}s" for k, v in timings.items()))
+    return results
+
+
+def _flatten(data, prefix=""):
+    """把嵌套结果展开成 {"single.deepseek.generate.p50": 0.2, ...}，只保留耗时、吞吐与未命中缓存的 token 数"""
+    flat = {}
+    for key, value in data.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name))
+        elif isinstance(value, (int, float)) and key not in ("n", "articles", "failed", "prompt_tokens", "cached_tokens"):
+            flat[name] = value
+    return flat
+
+
+def compare(current, previous, threshold):
+    """与上一次结果对比；吞吐类指标越大越好，其余越小越好"""
+    old = _flatten(previous["results"])
+    regressions = []
+    print(f"\n--- 与 {previous['timestamp']} 对比 ---")
+    for name, value in _flatten(current["results"]).items():
+        if name not in old or not old[name]:
+            continue
+        ratio = value / old[name]
+        worse = ratio < 1 - threshold if name.endswith("per_sec") else ratio > 1 + threshold
+        mark = "  <-- 退化" if worse else ""
+        print(f"{name}: {old[name]} -> {value} ({ratio:.2f}x){mark}")
+        if worse:
+            regressions.append(name)
+    return regressions
+
+
+def latest_result(directory, quick, mock):
+    """最近一次参数相同（--quick 与 mock 配置一致）的结果"""
+    try:
+        files = sorted((f for f in os.listdir(directory) if f.endswith(".json")), reverse=True)
+    except FileNotFoundError:
+        return None
+    for name in files:
+        with open(os.path.join(directory, name), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("quick") == quick and data.get("mock") == mock:
+            return data
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="基于本地 mock 服务的离线基准测试")
+    parser.add_argument("--quick", action="store_true", help="减少轮数与规模")
+    parser.add_argument("--only", choices=SCENARIOS, action="append", help="只运行指定场景，可重复")
+    parser.add_argument("--latency", type=float, default=0.2, help="mock 服务每个请求的延迟（秒）")
+    parser.add_argument("--chunk-delay", type=float, default=0.01, help="流式响应每块之间的间隔（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="以 429/500 响应的请求比例")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对变化阈值")
+    parser.add_argument("--output", default=RESULTS_DIR)
+    args = parser.parse_args()
+
+    scenarios = args.only or SCENARIOS
+    rounds = 3 if args.quick else 10
+    levels = (1, 4) if args.quick else (1, 4, 8, 16)
+    articles = 4 if args.quick else 16
+    sizes = (1000, 10000) if args.quick else (1000, 10000, 100000)
+
+    output = os.path.abspath(args.output)
+    mock = {"latency": args.latency, "chunk_delay": args.chunk_delay, "error_rate": args.error_rate}
+    previous = latest_result(output, args.quick, mock)
+    config = MockConfig(args.latency, args.chunk_delay, error_rate=args.error_rate, seed=args.seed)
+    root = tempfile.mkdtemp(prefix="wechatoa-bench-")
+    cwd = os.getcwd()
+    # 指标事件写到临时目录，不污染仓库下的 metrics/
+    from metrics import recorder
+    recorder.directory = os.path.join(root, "metrics")
+
+    results = {}
+    try:
+        with MockServer(config) as server:
+            print(f"Mock server: {server.url} (latency {args.latency}s, error rate {args.error_rate})")
+            if "single" in scenarios:
+                print("\n[single] 单篇文章端到端延迟")
+                _workspace(root, "single")
+                results["single"] = bench_single(server.url, rounds)
+            if "batch" in scenarios:
+                print("\n[batch] 批量吞吐")
+                results["batch"] = bench_batch(server.url, root, levels, articles)
+            if "conversation" in scenarios:
+                print("\n[conversation] 对话模式的前缀缓存")
+                results["conversation"] = bench_conversation(server.url, root, articles)
+        if "manifest" in scenarios:
+            print("\n[manifest] 存档规模")
+            results["manifest"] = bench_manifest(root, sizes)
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(root, ignore_errors=True)
+
+    current = {
+        "timestamp": datetime.datetime.now().strftime("%Y%m%dT%H%M%S"),
+        "quick": args.quick,
+        "mock": mock,
+        "results": results,
+    }
+    os.makedirs(output, exist_ok=True)
+    path = os.path.join(output, f"{current['timestamp']}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(current, f, ensure_ascii=False, indent=2)
+    print(f"\n结果已保存: {path}")
+
+    if previous:
+        regressions = compare(current, previous, args.threshold)
+        if regressions:
+            print(f"发现 {len(regressions)} 项退化")
+
+
+if __name__ == "__main__":
+    main()
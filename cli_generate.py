@@ -1,52 +1,170 @@
 import os
+import sys
 import json
-import markdown
-import datetime
-import re
 import argparse
-from llm_client import DeepSeekClient
-from main import PromptManager, deploy_to_github
+import contextlib
+from llm_client import create_client
+from scheduler import ProviderScheduler
+from wechat_client import WeChatClient
+from metrics import recorder
+from main import (PromptManager, load_config, add_cache_arguments, add_conversation_argument, add_profile_argument,
+                  get_job_store, check_duplicate, print_duplicates)
+from batch import load_jobs, run_batch
+from pipeline import deploy_job, run_step
+from job_store import WECHAT_MEDIA_ID, WECHAT_REQUESTED, finished
+
+def create_llm(provider, config, cache_mode="use"):
+    """按 --provider 创建客户端；缺少 API Key 时抛出 ValueError"""
+    if provider == "auto":
+        return ProviderScheduler.from_config(config, cache_mode=cache_mode)
+    env_key = "DEEPSEEK_API_KEY" if provider == "deepseek" else "GEMINI_API_KEY"
+    if not os.getenv(env_key):
+        raise ValueError(f"{env_key} not found in environment.")
+    model = "deepseek-reasoner" if provider == "deepseek" else None
+    return create_client(provider, config, model=model, cache_mode=cache_mode)
+
+def review_workers(config, llm):
+    """分节审查的并发数：沿用 config.json 中该 Provider 的并发上限"""
+    limits = config.get("concurrency", {})
+    return limits.get(llm.provider) or sum(limits.values()) or 4
+
+def run_job(store, job, llm, prompts, stream=False, section_review=False, max_workers=4, log=print, deploy_lock=None,
+            conversation=False):
+    """把单个任务从最后完成的步骤推进到 deployed，每步输出先写入 jobs.db 再进入下一步
+
+    section_review=True 时 Stage 4 按小标题拆分并发审查（风格需提供 Stage 4 Section / Stage 4 Ending）。
+    conversation=True 时各阶段作为同一段对话的连续轮次发送，以命中提供方的前缀缓存。
+    log 接收进度信息；多个任务并发运行时传入 deploy_lock 串行化部署。
+    """
+    def deploy(job):
+        with deploy_lock or contextlib.nullcontext():
+            deploy_job(job)
+
+    while job["state"] != "deployed":
+        state, outputs = run_step(job, llm, prompts, stream, section_review, max_workers, conversation, deploy, log)
+        store.advance(job["id"], state, **outputs)
+        job = store.get(job["id"])
+    return job
+
+def preflight(jobs):
+    """查重：与已发布文章相似度超过 dedup.skip 的任务被跳过，超过 dedup.warn 的只提示"""
+    kept = []
+    for job in jobs:
+        level, matches = check_duplicate(job["title"], job["angle"])
+        print_duplicates(job["title"], matches)
+        if level == "skip":
+            print(f"跳过重复选题: {job['title']} (如确需生成请加 --allow-duplicate)")
+        else:
+            kept.append(job)
+    return kept
+
+def print_jobs(store):
+    for job in store.recent():
+        error = f"  ({job['error'][:80]})" if job["error"] else ""
+        print(f"#{job['id']:<5} {job['state']:<9} {job['style']:<12} {job['title']}{error}")
 
 def run_generate():
     parser = argparse.ArgumentParser()
-    parser.add_argument("--title", required=True)
-    parser.add_argument("--angle", required=True)
+    parser.add_argument("--title")
+    parser.add_argument("--angle")
     parser.add_argument("--date", default="")
     parser.add_argument("--style", default="psychology")
     parser.add_argument("--keep-existing", action="store_true", default=True)
     parser.add_argument("--no-keep", action="store_false", dest="keep_existing")
+    parser.add_argument("--batch", help="JSONL 任务文件，每行一个 {title, angle, style, date}")
+    parser.add_argument("--concurrency", type=int, help="覆盖 config.json 中的单 Provider 并发上限")
+    parser.add_argument("--provider", choices=["deepseek", "gemini", "auto"], default="deepseek",
+                        help="auto: 按 config.json 的 scheduler 配置在多个后端间调度与故障切换")
+    parser.add_argument("--wechat-draft", action="store_true", help="同时把内联样式版正文上传到公众号草稿箱")
+    parser.add_argument("--stream", action="store_true", help="流式生成，各阶段输出实时写入 drafts/<标题>/")
+    parser.add_argument("--fast-import", action="store_true", help="批量模式下用 git fast-import 提交（适合大批量回填）")
+    parser.add_argument("--section-review", action="store_true",
+                        help="Stage 4 按小标题拆分并发审查，结尾单独处理（适合长文）")
+    parser.add_argument("--allow-duplicate", action="store_true", help="跳过与已发布文章的查重")
+    parser.add_argument("--resume", nargs="?", const="all", metavar="JOB_ID",
+                        help="从最后完成的步骤继续未部署的任务（默认全部，或指定任务编号）")
+    parser.add_argument("--jobs", action="store_true", help="列出最近的任务及其状态")
+    add_conversation_argument(parser)
+    add_cache_arguments(parser)
+    add_profile_argument(parser)
     args = parser.parse_args()
 
+    store = get_job_store()
+    if args.jobs:
+        print_jobs(store)
+        return
+    if not args.batch and not args.resume and not (args.title and args.angle):
+        parser.error("--title 和 --angle 为必填项 (或使用 --batch / --resume)")
+
     pm = PromptManager()
-    if args.style not in pm.prompts:
+    if not args.batch and not args.resume and args.style not in pm.prompts:
         print(f"Error: Style {args.style} not found.")
-        return
+        return 1
 
-    prompts = pm.prompts[args.style]
-    api_key = os.getenv("DEEPSEEK_API_KEY")
-    if not api_key:
-        print("Error: DEEPSEEK_API_KEY not found in environment.")
-        return
+    if args.batch and not args.resume:
+        jobs = load_jobs(args.batch, default_style=args.style)
+    # 在花费 LLM 调用之前查重；--resume 继续的任务在创建时已查过
+    if not args.resume and not args.allow_duplicate:
+        if args.batch:
+            jobs = preflight(jobs)
+            if not jobs:
+                print("没有需要生成的文章。")
+                return
+        elif not preflight([{"title": args.title, "angle": args.angle}]):
+            return
+
+    config = load_config()
+    try:
+        llm = create_llm(args.provider, config, args.cache_mode)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+
+    if args.resume:
+        if args.resume == "all":
+            jobs = store.unfinished()
+        else:
+            job = store.get(int(args.resume))
+            jobs = [job] if job and not finished(job) else []
+        if not jobs:
+            print("没有需要继续的任务。")
+            return
+        for job in jobs:
+            print(f"继续任务 #{job['id']} ({job['state']}): {job['title']}")
+
+    if args.batch or args.resume:
+        limits = config.get("concurrency", {})
+        if args.concurrency and llm.provider:
+            limits[llm.provider] = args.concurrency
+        print(f"--- 批量生成 {len(jobs)} 篇文章 (并发上限: {limits}) ---")
+        wechat = WeChatClient.from_env() if args.wechat_draft else None
+        failed = run_batch(jobs, llm, pm, limits, args.keep_existing, stream=args.stream, fast_import=args.fast_import,
+                  wechat=wechat, section_review=args.section_review, conversation=args.conversation)
+        if args.profile:
+            print(recorder.summary())
+        # 有任务失败时以非零状态退出，CI 据此把本次运行标为失败、可重新运行续跑
+        return 1 if failed else 0
 
-    llm = DeepSeekClient(api_key, model="deepseek-reasoner")
-    
-    print(f"--- 正在生成文章: {args.title} ---")
-    
-    print("[1/3] 正在生成大纲 (Reasoner Thinking)...")
-    outline = llm.generate(prompts['Stage 2'].format(title=args.title, angle=args.angle))
-    
-    print("[2/3] 正在撰写正文...")
-    content = llm.generate(prompts['Stage 3'].format(outline=outline))
-    
-    print("[3/3] 正在润色审查...")
-    final_md = llm.generate(prompts['Stage 4'].format(content=content))
-    
-    html = markdown.markdown(final_md, extensions=['extra'])
-    date_str = args.date if args.date else datetime.datetime.now().strftime('%Y-%m-%d')
-    clean_title = re.sub(r'[\/:*?"<>|]', '_', args.title)
-    
-    deploy_to_github(f"{clean_title}.html", html, args.title, date_str, args.keep_existing)
+    job = store.create(args.title, args.angle, args.style, args.date, args.keep_existing)
+    if args.wechat_draft:
+        store.save_output(job["id"], WECHAT_REQUESTED, "1")
+    print(f"--- 正在生成文章: {args.title} (任务 #{job['id']}) ---")
+    try:
+        job = run_job(store, job, llm, pm.prompts[args.style], stream=args.stream, section_review=args.section_review,
+                      max_workers=review_workers(config, llm), conversation=args.conversation)
+    except Exception as e:
+        store.fail(job["id"], e)
+        print(f"Error: {e}")
+        print(f"已完成的阶段已保存，可使用 python cli_generate.py --resume {job['id']} 继续")
+        return 1
+    if args.wechat_draft:
+        media_id = WeChatClient.from_env().upload_draft(args.title, job["outputs"]["wechat_html"],
+                                                        thumb_media_id=os.getenv("WECHAT_THUMB_MEDIA_ID", ""))
+        if media_id:
+            store.save_output(job["id"], WECHAT_MEDIA_ID, media_id)
     print(f"--- 任务完成: {args.title} ---")
+    if args.profile:
+        print(recorder.summary())
 
 if __name__ == "__main__":
-    run_generate()
+    sys.exit(run_generate())
@@ -0,0 +1,56 @@
+from job_store import STAGES, STATES
+
+# 对话模式下上一阶段的输出已在历史消息中，模板里引用它的占位符换成这段指代，不再重复发送全文
+PREVIOUS_REPLY = {
+    "outline": "（见上一条回复中的大纲）",
+    "content": "（见上一条回复中的正文）",
+}
+
+
+def user_turn(prompts, stage, **fields):
+    """对话模式下某阶段的用户消息"""
+    return prompts[stage].format(**{k: PREVIOUS_REPLY.get(k, v) for k, v in fields.items()})
+
+
+class Conversation:
+    """把文章流水线的各阶段串成一段对话：系统提示与此前各轮消息逐字不变，只在末尾追加
+
+    DeepSeek 的上下文缓存与 Gemini 的隐式缓存都按请求前缀命中，后续阶段重复的历史按缓存价计费、预填充更快，
+    失败重试或续跑时整段前缀都能命中。代价是每个阶段都带上此前全部历史：输入 token 总数约为单轮请求的两倍，
+    而每段输出首次作为输入时仍是未命中，总费用通常高于单轮请求（见 benchmark.py --only conversation）。
+    每次调用的命中 token 数照常记入 metrics（cached_tokens，按阶段汇总）。
+    """
+
+    def __init__(self, llm, system_instruction=None, history=None):
+        self.llm = llm
+        self.system_instruction = system_instruction
+        self.history = list(history or [])
+
+    def send(self, prompt, strict=False, path=None):
+        """发送一轮用户消息并把回复追加到历史；传入 path 时流式写入草稿文件"""
+        if path:
+            text = self.llm.generate_to_file(prompt, path, self.system_instruction, strict, history=self.history)
+        else:
+            text = self.llm.generate(prompt, self.system_instruction, strict, history=self.history)
+        self.append(prompt, text)
+        return text
+
+    def append(self, prompt, reply):
+        """记录一轮已有的问答（如预先生成的大纲），不发请求"""
+        # 换成新列表而不是原地追加：仍在后台进行的请求（如预取）持有的是旧历史
+        self.history = self.history + [{"role": "user", "content": prompt}, {"role": "assistant", "content": reply}]
+
+
+def job_conversation(llm, job, prompts):
+    """由任务已保存的各阶段输出重建对话，返回 (对话, 下一阶段的用户消息)；三个阶段都已完成时消息为 None
+
+    历史逐字由 jobs.db 中的输出重建，--resume 续跑时前缀与中断前完全一致，仍能命中提供方缓存。
+    """
+    conversation = Conversation(llm, prompts.get("Stage 1_system"))
+    done = STATES.index(job["state"])
+    for state, stage, draft, fields in STAGES:
+        prompt = user_turn(prompts, stage, **fields(job))
+        if STATES.index(state) > done:
+            return conversation, prompt
+        conversation.append(prompt, job["outputs"][state])
+    return conversation, None
@@ -0,0 +1,175 @@
+import functools
+import hashlib
+import re
+import sqlite3
+import struct
+import threading
+
+from manifest_store import DB_PATH
+
+# 索引单独存放，不随 articles.db 发布
+DEDUP_DB_PATH = "dedup.db"
+
+NGRAM = 2
+NUM_PERM = 64
+# 16 个 band × 每 band 4 行：Jaccard ≥ 0.6 的标题有约 89% 的概率落入同一个桶，≥ 0.7 时约 99%
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+# 按命中 band 数排序后只取前 limit × CANDIDATES 篇做精确复核；命中 band 越多的标题 Jaccard 越高
+CANDIDATES = 8
+# 套路化标题会让少数桶变得很大，每个 band 最多取最近的 BUCKET_CAP 篇参与计数
+BUCKET_CAP = 200
+_unpack_hashes = struct.Struct(f"<{NUM_PERM}I").unpack
+
+
+def shingles(text, n=NGRAM):
+    """去掉空白与标点后的字符 n-gram 集合（中文按字切分，无需分词）"""
+    text = re.sub(r"[\W_]+", "", text.lower())
+    if len(text) <= n:
+        return {text} if text else set()
+    return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+
+@functools.lru_cache(maxsize=1 << 16)
+def _gram_hashes(gram):
+    # 中文标题的二字组合数量有限，建索引时大部分 n-gram 都会命中缓存
+    return _unpack_hashes(hashlib.shake_128(gram.encode("utf-8")).digest(4 * NUM_PERM))
+
+
+def minhash(grams):
+    """MinHash 签名：每个 n-gram 用 SHAKE-128 一次产出 NUM_PERM 个相互独立的 32 位哈希，逐位取最小值
+
+    不依赖随机种子，签名在不同进程、不同机器间一致；逐位取最小由 zip/map 在 C 层完成。
+    """
+    return list(map(min, zip(*map(_gram_hashes, grams))))
+
+
+def band_keys(signature):
+    """每个 band 的桶编号：该 band 的 ROWS 个 32 位值折叠为一个 64 位有符号整数（便于存入 SQLite），并混入 band 序号"""
+    keys = []
+    for band in range(BANDS):
+        key = band
+        for value in signature[band * ROWS:(band + 1) * ROWS]:
+            key = (key * 0x100000001B3 ^ value) & 0xFFFFFFFFFFFFFFFF
+        keys.append(key - (1 << 64) if key >= 1 << 63 else key)
+    return keys
+
+
+def jaccard(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class DedupIndex:
+    """已发布标题的 MinHash/LSH 索引，查询只需按桶编号做几次主键范围查找
+
+    索引存在单独的 dedup.db 中，以只读方式 ATTACH manifest 的 articles.db 与之比对；
+    桶表以 (桶编号, 文章编号) 为主键、WITHOUT ROWID 存储，不另建索引，也不重复存放 URL。
+    sync() 把 manifest 中新增的文章补进索引、移除已不存在的文章；候选标题再用精确的 Jaccard 相似度复核。
+    """
+
+    def __init__(self, db_path=DEDUP_DB_PATH, manifest_db=DB_PATH):
+        self.lock = threading.Lock()
+        # 本进程内是否已与 manifest 同步过；此后由部署时的 sync() 保持一致，查询路径不再检查
+        self.synced = False
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        # articles 表由 ManifestStore 创建（含从 articles.json 迁移），须先打开 ManifestStore
+        self.conn.execute("ATTACH DATABASE ? AS manifest", (manifest_db,))
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS minhash_docs ("
+                " id INTEGER PRIMARY KEY, url TEXT NOT NULL UNIQUE, title TEXT NOT NULL)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS minhash_buckets ("
+                " bucket INTEGER NOT NULL, doc INTEGER NOT NULL, PRIMARY KEY (bucket, doc)) WITHOUT ROWID")
+        self._drop_legacy_tables()
+
+    def _drop_legacy_tables(self):
+        """早先的版本把索引表建在 articles.db 里，删除并压缩，避免随 manifest 一起发布"""
+        legacy = self.conn.execute(
+            "SELECT COUNT(*) FROM manifest.sqlite_master WHERE name IN ('minhash_docs', 'minhash_buckets')").fetchone()[0]
+        if not legacy:
+            return
+        with self.conn:
+            self.conn.execute("DROP TABLE IF EXISTS manifest.minhash_buckets")
+            self.conn.execute("DROP TABLE IF EXISTS manifest.minhash_docs")
+        self.conn.execute("VACUUM manifest")
+
+    def sync(self):
+        """让索引与 manifest 一致，返回 (新增, 删除) 篇数"""
+        with self.lock, self.conn:
+            articles = self.conn.execute("SELECT COUNT(*) FROM manifest.articles").fetchone()[0]
+            indexed = self.conn.execute("SELECT COUNT(*) FROM minhash_docs").fetchone()[0]
+            # 篇数相同且最后插入的文章已在索引中，视为一致（清空后再添加时最新一篇必然不在索引中）
+            latest = self.conn.execute(
+                "SELECT EXISTS (SELECT 1 FROM minhash_docs WHERE url ="
+                " (SELECT url FROM manifest.articles ORDER BY rowid DESC LIMIT 1))").fetchone()[0]
+            if articles == indexed and (latest or not articles):
+                self.synced = True
+                return 0, 0
+            # 删除只在 --no-keep 清空 manifest 后出现，整表扫描一次即可
+            stale = self.conn.execute(
+                "DELETE FROM minhash_docs WHERE url NOT IN (SELECT url FROM manifest.articles)").rowcount
+            if stale:
+                self.conn.execute("DELETE FROM minhash_buckets WHERE doc NOT IN (SELECT id FROM minhash_docs)")
+            added = self.conn.execute(
+                "SELECT url, title FROM manifest.articles WHERE url NOT IN (SELECT url FROM minhash_docs)").fetchall()
+            self._insert(added)
+            self.synced = True
+        return len(added), stale
+
+    def _insert(self, articles):
+        rows = []
+        for url, title in articles:
+            doc = self.conn.execute("INSERT INTO minhash_docs (url, title) VALUES (?, ?)", (url, title)).lastrowid
+            grams = shingles(title)
+            if grams:
+                rows += [(key, doc) for key in band_keys(minhash(grams))]
+        # 按主键顺序插入，B 树只在末尾追加，首次全量建索引快得多
+        rows.sort()
+        self.conn.executemany("INSERT OR IGNORE INTO minhash_buckets (bucket, doc) VALUES (?, ?)", rows)
+
+    def query(self, text, limit=3):
+        """返回与 text 最相似的已发布文章 [(相似度, 标题, url), ...]，按相似度降序
+
+        每个 band 最多取 BUCKET_CAP 篇，按命中 band 数在 SQL 中排序截断，只取少量候选回 Python 复核。
+        """
+        grams = shingles(text)
+        if not grams:
+            return []
+        keys = band_keys(minhash(grams))
+        bands = " UNION ALL ".join(
+            ["SELECT doc FROM (SELECT doc FROM minhash_buckets WHERE bucket = ? ORDER BY doc DESC LIMIT ?)"] * len(keys))
+        params = [value for key in keys for value in (key, BUCKET_CAP)]
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT d.url, d.title FROM ("
+                f" SELECT doc, COUNT(*) AS hits FROM ({bands}) GROUP BY doc ORDER BY hits DESC LIMIT ?"
+                ") c JOIN minhash_docs d ON d.id = c.doc",
+                params + [limit * CANDIDATES],
+            ).fetchall()
+        matches = sorted(((jaccard(grams, shingles(title)), title, url) for url, title in rows), reverse=True)
+        return matches[:limit]
+
+    def close(self):
+        self.conn.close()
+
+
+def check_topic(index, title, angle="", warn=0.6, skip=0.8):
+    """发布前查重：返回 (级别, 匹配列表)，级别为 None / "warn" / "skip"
+
+    标题与切入点分别查询；切入点通常比标题长，只在与某个已发布标题高度重合时才会命中。
+    本进程首次查询前同步一次索引（正在后台同步时等待其完成），之后由部署时的 sync() 保持一致。
+    """
+    if not index.synced:
+        index.sync()
+    matches = {}
+    for text in (title, angle):
+        for similarity, matched, url in index.query(text) if text else []:
+            if similarity > matches.get(url, (0,))[0]:
+                matches[url] = (similarity, matched, url)
+    matches = sorted((m for m in matches.values() if m[0] >= warn), reverse=True)
+    if not matches:
+        return None, []
+    return ("skip" if matches[0][0] >= skip else "warn"), matches
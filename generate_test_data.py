@@ -3,9 +3,11 @@ import markdown
 import json
 import datetime
 import re
-from main import deploy_to_github
+import sys
+from main import deploy_to_github, export_site
+from git_publisher import GitBatch
 
-def test_batch():
+def test_batch(fast_import=False):
     test_articles = [
         # Day 1
         {"title": "理解‘聚光灯效应’：你没那么多人关注", "date": "2026-02-22"},
@@ -21,14 +23,16 @@ def test_batch():
         {"title": "拒绝内耗的5个心理学建议", "date": "2026-02-24"},
     ]
 
-    for art in test_articles:
-        print(f"Generating mock article: {art['title']} for {art['date']}")
-        dummy_content = f"<p>这是关于 {art['title']} 的测试正文内容。</p><p>发布于 {art['date']}。</p>"
-        clean_title = re.sub(r'[\/:*?"<>|]', '_', art['title'])
-        deploy_to_github(f"{clean_title}.html", dummy_content, art['title'], art['date'])
+    with GitBatch(f"Add {len(test_articles)} test articles", fast_import=fast_import) as batch:
+        for art in test_articles:
+            print(f"Generating mock article: {art['title']} for {art['date']}")
+            dummy_content = f"<p>这是关于 {art['title']} 的测试正文内容。</p><p>发布于 {art['date']}。</p>"
+            clean_title = re.sub(r'[\/:*?"<>|]', '_', art['title'])
+            deploy_to_github(f"{clean_title}.html", dummy_content, art['title'], art['date'], export=False, batch=batch)
+        batch.add(*export_site())
 
 if __name__ == "__main__":
     # Ensure docs is empty for a clean test
     if os.path.exists("docs/articles.json"):
         os.remove("docs/articles.json")
-    test_batch()
+    test_batch(fast_import="--fast-import" in sys.argv)
@@ -0,0 +1,141 @@
+import os
+import re
+import subprocess
+
+from metrics import recorder
+
+
+def _git(*args, input=None, check=True):
+    return subprocess.run(["git", *args], input=input, capture_output=True, check=check)
+
+
+def _repo_relative(paths):
+    """把相对当前目录的路径转换为相对仓库根目录的路径（fast-import 需要）"""
+    prefix = _git("rev-parse", "--show-prefix").stdout.decode("utf-8").strip()
+    return [(p, (prefix + os.path.normpath(p)).replace(os.sep, "/")) for p in paths]
+
+
+def pages_url():
+    """推断站点的 GitHub Pages 地址：优先 CNAME 自定义域名，其次 GITHUB_REPOSITORY（Actions 中）或 origin 远端；推断不出时返回空字符串"""
+    if os.path.exists("CNAME"):
+        with open("CNAME", "r", encoding="utf-8") as f:
+            domain = f.read().strip()
+        if domain:
+            return f"https://{domain}/"
+    repo = os.getenv("GITHUB_REPOSITORY", "")
+    if not repo:
+        remote = _git("remote", "get-url", "origin", check=False).stdout.decode("utf-8").strip()
+        match = re.search(r"github\.com[:/]([^/]+/[^/]+?)(?:\.git)?/?$", remote)
+        repo = match.group(1) if match else ""
+    if "/" not in repo:
+        return ""
+    owner, name = repo.split("/", 1)
+    if name.lower() == f"{owner.lower()}.github.io":
+        return f"https://{name}/"
+    return f"https://{owner.lower()}.github.io/{name}/"
+
+
+def commit_paths(paths, message):
+    """只暂存并提交给定路径，不再对整个工作区执行 git add ."""
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return False
+    with recorder.timed("deploy", "git_commit", files=len(paths)):
+        return _commit_paths(paths, message)
+
+
+def _commit_paths(paths, message):
+    try:
+        present = [p for p in paths if os.path.exists(p)]
+        missing = [p for p in paths if not os.path.exists(p)]
+        if present:
+            _git("add", "--pathspec-from-file=-", "--pathspec-file-nul",
+                 input="\0".join(present).encode("utf-8"))
+        if missing:
+            _git("rm", "--cached", "--ignore-unmatch", "-q", "--", *missing)
+        if _git("diff", "--cached", "--quiet", check=False).returncode == 0:
+            print("没有需要提交的变更。")
+            return False
+        _git("commit", "-q", "-m", message)
+        # We don't push here in a local environment because it might mess up branches
+        # This will be handled by the specialized GitHub Action
+        print(f"本地文件已提交 ({len(paths)} 个文件)。")
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        detail = getattr(e, "stderr", b"") or b""
+        print(f"Git 发布失败: {e} {detail.decode('utf-8', 'replace').strip()}")
+        return False
+
+
+def fast_import_paths(paths, message):
+    """用 git fast-import 直接写入一个提交，跳过索引和工作区扫描，适合大批量回填"""
+    paths = list(dict.fromkeys(paths))
+    if not paths:
+        return False
+    with recorder.timed("deploy", "git_fast_import", files=len(paths)):
+        return _fast_import_paths(paths, message)
+
+
+def _fast_import_paths(paths, message):
+    try:
+        branch = _git("symbolic-ref", "-q", "HEAD").stdout.decode("utf-8").strip()
+        parent = _git("rev-parse", "-q", "--verify", "HEAD", check=False).stdout.decode("utf-8").strip()
+        ident = _git("var", "GIT_COMMITTER_IDENT").stdout.decode("utf-8").strip()
+        msg = message.encode("utf-8")
+
+        proc = subprocess.Popen(["git", "fast-import", "--quiet"], stdin=subprocess.PIPE)
+        out = proc.stdin
+        out.write(f"commit {branch}\ncommitter {ident}\ndata {len(msg)}\n".encode("utf-8") + msg + b"\n")
+        if parent:
+            out.write(f"from {parent}\n".encode("utf-8"))
+        for local, repo_path in _repo_relative(paths):
+            if not os.path.exists(local):
+                out.write(f"D {repo_path}\n".encode("utf-8"))
+                continue
+            with open(local, "rb") as f:
+                data = f.read()
+            out.write(f"M 100644 inline {repo_path}\ndata {len(data)}\n".encode("utf-8"))
+            out.write(data + b"\n")
+        out.close()
+        if proc.wait() != 0:
+            raise subprocess.CalledProcessError(proc.returncode, "git fast-import")
+        # 提交已直接写入分支，同步索引使 git status 保持干净
+        _git("reset", "-q")
+        print(f"本地文件已通过 fast-import 提交 ({len(paths)} 个文件)。")
+        return True
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Git 发布失败: {e}")
+        return False
+
+
+class GitBatch:
+    """收集一批文章写出的文件路径，整批只做一次 git 操作
+
+    with GitBatch("Add 30 articles") as batch:
+        deploy_to_github(..., batch=batch)
+    """
+
+    def __init__(self, message, fast_import=False):
+        self.message = message
+        self.fast_import = fast_import
+        self.paths = []
+
+    def add(self, *paths):
+        self.paths.extend(paths)
+
+    def commit(self, message=None):
+        message = message or self.message
+        if self.fast_import:
+            committed = fast_import_paths(self.paths, message)
+        else:
+            committed = commit_paths(self.paths, message)
+        self.paths = []
+        return committed
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # 中途出错时也提交已经写出的文章，避免工作区留下未提交的半成品
+        self.commit()
+        return False
@@ -0,0 +1,144 @@
+import datetime
+import sqlite3
+import threading
+import time
+
+DB_PATH = "jobs.db"
+
+# 状态按顺序推进，每个状态表示对应步骤已完成且输出已落盘
+STATES = ("queued", "outline", "content", "review", "rendered", "deployed")
+
+# LLM 阶段: (完成后的状态, prompts 中的阶段名, 流式草稿文件名, 由任务生成 format 参数)
+# 每个阶段的输出以其状态名保存，"review" 即润色后的最终 Markdown
+STAGES = (
+    ("outline", "Stage 2", "outline.md", lambda job: {"title": job["title"], "angle": job["angle"]}),
+    ("content", "Stage 3", "content.md", lambda job: {"outline": job["outputs"]["outline"]}),
+    ("review", "Stage 4", "final.md", lambda job: {"content": job["outputs"]["content"]}),
+)
+
+# 需要上传公众号草稿的任务在开始处理时记下这一项，上传成功后另存 wechat_media_id；
+# 部署后、上传前中断的任务仍算未完成，续跑时补传
+WECHAT_REQUESTED = "wechat_requested"
+WECHAT_MEDIA_ID = "wechat_media_id"
+
+
+def finished(job):
+    """已部署，且没有待上传的公众号草稿"""
+    outputs = job["outputs"]
+    return job["state"] == "deployed" and (WECHAT_REQUESTED not in outputs or WECHAT_MEDIA_ID in outputs)
+
+
+class JobStore:
+    """文章生成任务的持久化状态机：每推进一步就在同一事务里写入状态和该步输出，进程中断后可从最后完成的步骤继续"""
+
+    def __init__(self, db_path=DB_PATH):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id INTEGER PRIMARY KEY AUTOINCREMENT, title TEXT NOT NULL, angle TEXT NOT NULL,"
+                " style TEXT NOT NULL, date TEXT NOT NULL, keep_existing INTEGER NOT NULL,"
+                " state TEXT NOT NULL, error TEXT, created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS outputs ("
+                " job_id INTEGER NOT NULL, name TEXT NOT NULL, text TEXT NOT NULL,"
+                " PRIMARY KEY (job_id, name))"
+            )
+
+    def create(self, title, angle, style, date="", keep_existing=True):
+        """新建任务；未指定日期时取当天，续跑时发布日期保持不变"""
+        date = date or datetime.datetime.now().strftime("%Y-%m-%d")
+        now = time.time()
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO jobs (title, angle, style, date, keep_existing, state, created, updated)"
+                " VALUES (?, ?, ?, ?, ?, 'queued', ?, ?)",
+                (title, angle, style, date, int(keep_existing), now, now),
+            )
+        return self.get(cur.lastrowid)
+
+    def get(self, job_id):
+        """返回任务字典，outputs 中是已完成步骤的输出；不存在时返回 None"""
+        with self.lock:
+            row = self.conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            outputs = self.conn.execute("SELECT name, text FROM outputs WHERE job_id = ?", (job_id,)).fetchall()
+        job = dict(row)
+        job["keep_existing"] = bool(job["keep_existing"])
+        job["outputs"] = {name: text for name, text in outputs}
+        return job
+
+    def advance(self, job_id, state, **outputs):
+        """把任务推进到 state 并保存该步输出；state 只能是当前状态的下一个"""
+        with self.lock, self.conn:
+            current = self.conn.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if current is None:
+                raise KeyError(job_id)
+            if STATES.index(state) != STATES.index(current["state"]) + 1:
+                raise ValueError(f"Job {job_id}: cannot move from {current['state']} to {state}")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO outputs (job_id, name, text) VALUES (?, ?, ?)",
+                ((job_id, name, text) for name, text in outputs.items()),
+            )
+            self.conn.execute("UPDATE jobs SET state = ?, error = NULL, updated = ? WHERE id = ?",
+                              (state, time.time(), job_id))
+
+    def save_output(self, job_id, name, text):
+        """保存不改变状态的附加输出（如公众号草稿 media_id）"""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO outputs (job_id, name, text) VALUES (?, ?, ?)",
+                              (job_id, name, text))
+
+    def set_keep_existing(self, job_ids, keep_existing=True):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE jobs SET keep_existing = ? WHERE id = ?",
+                                  ((int(keep_existing), job_id) for job_id in job_ids))
+
+    def clearing(self, job_ids):
+        """job_ids 中仍要求清空 manifest（keep_existing 为假）的任务"""
+        job_ids = list(job_ids)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT id FROM jobs WHERE keep_existing = 0 AND id IN ({','.join('?' * len(job_ids))})", job_ids
+            ).fetchall()
+        return [r[0] for r in rows]
+
+    def fail(self, job_id, error):
+        """记录失败原因，状态保持在最后完成的步骤"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE jobs SET error = ?, updated = ? WHERE id = ?",
+                              (str(error)[:1000], time.time(), job_id))
+
+    def unfinished(self):
+        """所有尚未部署、或已部署但公众号草稿尚未上传的任务，按创建顺序"""
+        with self.lock:
+            ids = [r[0] for r in self.conn.execute(
+                "SELECT id FROM jobs WHERE state != 'deployed'"
+                " OR (id IN (SELECT job_id FROM outputs WHERE name = ?)"
+                " AND id NOT IN (SELECT job_id FROM outputs WHERE name = ?)) ORDER BY id",
+                (WECHAT_REQUESTED, WECHAT_MEDIA_ID))]
+        return [self.get(job_id) for job_id in ids]
+
+    def recent(self, limit=20):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT id, title, style, state, error, updated FROM jobs ORDER BY id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        return [dict(r) for r in rows]
+
+    def close(self):
+        self.conn.close()
+
+
+def next_stage(job, prompts):
+    """下一个要调用 LLM 的阶段: (完成后的状态, 阶段名, 草稿文件名, prompt)；三个阶段都已完成时返回 None"""
+    done = STATES.index(job["state"])
+    for state, stage, draft, fields in STAGES:
+        if STATES.index(state) > done:
+            return state, stage, draft, prompts[stage].format(**fields(job))
+    return None
@@ -0,0 +1,121 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+DEFAULT_DIR = ".llm_cache"
+DEFAULT_MAX_MB = 200
+DEFAULT_TTL_DAYS = 7
+
+CACHE_MODES = ("use", "bypass", "refresh")
+
+
+class DiskCache:
+    """按内容寻址的 LLM 输出缓存：每个条目一个文件，按 mtime 做 LRU，超出容量时淘汰最久未用的条目"""
+
+    def __init__(self, directory=DEFAULT_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024, ttl=DEFAULT_TTL_DAYS * 86400):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._evict_lock = threading.Lock()
+        # 缓存目录总大小的估计值，首次写入时扫描一次初始化；此后每次写入累加，超出容量时才完整扫描淘汰
+        self._size = None
+
+    @classmethod
+    def from_config(cls, section):
+        section = section or {}
+        return cls(
+            directory=section.get("dir", DEFAULT_DIR),
+            max_bytes=int(section.get("max_mb", DEFAULT_MAX_MB) * 1024 * 1024),
+            ttl=section.get("ttl_days", DEFAULT_TTL_DAYS) * 86400,
+        )
+
+    @staticmethod
+    def make_key(provider, model, system_instruction, prompt):
+        raw = json.dumps([provider, model, system_instruction or "", prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if self.ttl and time.time() - entry.get("created", 0) > self.ttl:
+            self._remove(path)
+            return None
+        try:
+            # 命中时刷新 mtime，淘汰按 mtime 从旧到新进行
+            os.utime(path)
+        except OSError:
+            pass
+        return entry.get("text")
+
+    def set(self, key, text, **meta):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(dict(meta, created=time.time(), text=text), f, ensure_ascii=False)
+        size = os.path.getsize(tmp)
+        try:
+            # 覆盖已有条目时只计增量
+            size -= os.path.getsize(path)
+        except OSError:
+            pass
+        os.replace(tmp, path)
+        with self._evict_lock:
+            if self._size is None:
+                self._size = self._scan()[1]
+            else:
+                self._size += size
+            over = self._size > self.max_bytes
+        if over:
+            self.evict()
+
+    def _scan(self):
+        """返回 ([(mtime, 大小, 路径), ...], 总大小)"""
+        entries = []
+        total = 0
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+        return entries, total
+
+    def evict(self):
+        """完整扫描缓存目录，超出容量时按 mtime 从旧到新淘汰，并校正总大小的估计值
+
+        估计值只统计本进程的写入，其他进程写入或过期删除造成的偏差在这里一并修正。
+        """
+        with self._evict_lock:
+            entries, total = self._scan()
+            self._size = total
+            if total <= self.max_bytes:
+                return
+            entries.sort()
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(path)
+                total -= size
+            self._size = total
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
@@ -1,54 +1,434 @@
 import requests
 import json
 import os
+import random
+import logging
+import threading
+import time
+import email.utils
+import contextvars
+from contextlib import contextmanager
+from requests.adapters import HTTPAdapter
+from llm_cache import DiskCache
+from metrics import recorder
 
-class GeminiClient:
-    def __init__(self, api_key, model="gemini-2.0-flash"):
+logger = logging.getLogger(__name__)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+DEFAULT_MAX_RETRIES = 4
+# (连接超时, 读取超时)；reasoner 模型单次调用可能需要数分钟
+DEFAULT_TIMEOUT = (10, 600)
+
+# 当前调用所属的流水线阶段（"Stage 2" 等），供调度与统计使用；asyncio.to_thread 会自动带入工作线程
+current_stage = contextvars.ContextVar("current_stage", default=None)
+
+# 可通过环境变量指向本地 mock 服务（见 mock_server.py / benchmark.py）
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
+
+_sessions = {}
+_limiters = {}
+_registry_lock = threading.Lock()
+
+
+class LLMError(Exception):
+    """LLM 请求在重试后仍然失败"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class LLMCancelled(LLMError):
+    """调用方通过 cancel 事件中止了流式生成"""
+
+
+class TokenBucket:
+    """线程安全的令牌桶：rate 为每秒补充的令牌数，burst 为桶容量"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.updated:
+                    self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    wait = self.updated - now
+            time.sleep(wait)
+
+    def pause(self, seconds):
+        """服务端要求退避时清空令牌，让共享此桶的所有线程一起等待"""
+        with self.lock:
+            self.tokens = 0.0
+            self.updated = max(self.updated, time.monotonic() + seconds)
+
+
+@contextmanager
+def llm_stage(name):
+    token = current_stage.set(name)
+    try:
+        yield
+    finally:
+        current_stage.reset(token)
+
+
+def get_session(provider):
+    """每个 Provider 共享一个 keep-alive 连接池"""
+    with _registry_lock:
+        if provider not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=32)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _sessions[provider] = session
+        return _sessions[provider]
+
+
+def configure_rate_limit(provider, rate, burst=1):
+    """为 Provider 设置共享令牌桶；已有相同参数的桶时沿用，不清零已消耗的令牌
+
+    每个客户端（调度器的每个后端、worker 的每个任务）创建时都会调用，只有 rate / burst 变化时才换新桶。
+    """
+    with _registry_lock:
+        bucket = _limiters.get(provider)
+        if bucket is None or bucket.rate != float(rate) or bucket.capacity != float(burst):
+            _limiters[provider] = TokenBucket(rate, burst)
+
+
+def get_limiter(provider):
+    return _limiters.get(provider)
+
+
+def retry_after_seconds(response):
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, when.timestamp() - time.time())
+
+
+def backoff_delay(attempt):
+    # Full jitter: 在 [0, min(cap, base * 2^attempt)] 内均匀取值
+    return random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+
+
+class BaseClient:
+    provider = None
+
+    def __init__(self, api_key, model, rate_limit=None, max_retries=DEFAULT_MAX_RETRIES, cache=None, cache_mode="use"):
         self.api_key = api_key
         self.model = model
-        self.url = f"https://generativelanguage.googleapis.com/v1beta/models/{self.model}:generateContent?key={self.api_key}"
+        self.max_retries = max_retries
+        self.session = get_session(self.provider)
+        if rate_limit:
+            configure_rate_limit(self.provider, rate_limit["rate"], rate_limit.get("burst", 1))
+        # cache_mode: use 读写缓存 / bypass 不读不写 / refresh 不读但写入新结果
+        self.cache = cache
+        self.cache_mode = cache_mode
+
+    def _cache_key(self, prompt, system_instruction, history=None):
+        if not self.cache or self.cache_mode == "bypass":
+            return None
+        if history:
+            prompt = json.dumps(history + [{"role": "user", "content": prompt}], ensure_ascii=False)
+        return DiskCache.make_key(self.provider, self.model, system_instruction, prompt)
+
+    def _cache_get(self, key):
+        if key is None or self.cache_mode != "use":
+            return None
+        return self.cache.get(key)
 
-    def generate(self, prompt, system_instruction=None):
+    def _cache_set(self, key, text):
+        if key is not None:
+            self.cache.set(key, text, provider=self.provider, model=self.model)
+
+    def _timed_call(self):
+        """每次调用记录一条 llm 事件：耗时、首 token 时间、token 用量、重试次数"""
+        return recorder.timed("llm", self.provider, model=self.model, stage=current_stage.get(), retries=0)
+
+    def generate(self, prompt, system_instruction=None, strict=False, history=None):
+        """返回生成的文本；失败时默认返回错误描述字符串，strict=True 时抛出 LLMError
+
+        history 为此前的对话 [{"role": "user" / "assistant", "content": ...}, ...]，prompt 作为新一轮用户消息接在其后。
+        """
+        with self._timed_call() as call:
+            key = self._cache_key(prompt, system_instruction, history)
+            cached = self._cache_get(key)
+            if cached is not None:
+                call["cache_hit"] = True
+                return cached
+            try:
+                text = self._generate(prompt, system_instruction, call, history)
+            except LLMError as e:
+                call["ok"] = False
+                call["error"] = str(e)[:300]
+                if strict:
+                    raise
+                return f"{self.error_prefix}: {e}"
+            self._cache_set(key, text)
+            return text
+
+    def _post(self, url, payload, headers=None, stream=False, call=None):
+        """发送请求；遇到 429/5xx 或网络错误时按 Retry-After 或带抖动的指数退避重试"""
+        headers = dict({"Content-Type": "application/json"}, **(headers or {}))
+        body = json.dumps(payload)
+        for attempt in range(self.max_retries + 1):
+            limiter = get_limiter(self.provider)
+            if limiter:
+                limiter.acquire()
+            try:
+                response = self.session.post(url, headers=headers, data=body, stream=stream, timeout=DEFAULT_TIMEOUT)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise LLMError(f"{type(e).__name__}: {e}")
+                delay = backoff_delay(attempt)
+                logger.warning(f"{self.provider} request failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code == 200:
+                    return response
+                if response.status_code not in RETRY_STATUS or attempt == self.max_retries:
+                    raise LLMError(f"{response.status_code} - {response.text}", response.status_code)
+                delay = retry_after_seconds(response)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                response.close()
+                if limiter:
+                    limiter.pause(delay)
+                logger.warning(f"{self.provider} returned {response.status_code}, retrying in {delay:.1f}s")
+            if call is not None:
+                call["retries"] = call.get("retries", 0) + 1
+            time.sleep(delay)
+
+    def _iter_sse(self, response, cancel=None):
+        """逐个产出 SSE 事件中 data: 字段的 JSON 对象
+
+        每收到一行（包括不产出正文的 reasoning_content 与 keep-alive 注释）都检查 cancel，
+        被置位时立即断开连接并抛出 LLMCancelled。
+        """
+        # text/event-stream 通常不带 charset，requests 会按 ISO-8859-1 解码
+        response.encoding = "utf-8"
+        try:
+            for line in response.iter_lines(decode_unicode=True):
+                if cancel is not None and cancel.is_set():
+                    raise LLMCancelled("cancelled")
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                try:
+                    yield json.loads(data)
+                except json.JSONDecodeError:
+                    logger.warning(f"{self.provider} sent malformed SSE data: {data[:200]}")
+        except requests.RequestException as e:
+            raise LLMError(f"Stream interrupted: {e}")
+        finally:
+            response.close()
+
+    def generate_to_file(self, prompt, path, system_instruction=None, strict=False, history=None, cancel=None):
+        """流式生成，每收到一块就写入 path，返回完整文本（失败处理与 history 同 generate）
+
+        cancel (threading.Event) 被置位后，在收到下一个 SSE 事件时（reasoner 的思考阶段也一样）断开连接并抛出
+        LLMCancelled；提供方在连接断开后停止生成，剩余输出不再计费。
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._timed_call() as call:
+            key = self._cache_key(prompt, system_instruction, history)
+            cached = self._cache_get(key)
+            if cached is not None:
+                with open(path, "w", encoding="utf-8") as f:
+                    f.write(cached)
+                call["cache_hit"] = True
+                logger.info(f"{self.provider} cache hit -> {path}")
+                return cached
+            if cancel is not None and cancel.is_set():
+                raise LLMCancelled("cancelled")
+            start = time.monotonic()
+            parts = []
+            chunks = self.generate_stream(prompt, system_instruction, call, history, cancel)
+            try:
+                with open(path, "w", encoding="utf-8") as f:
+                    for chunk in chunks:
+                        if not parts:
+                            call["ttft"] = round(time.monotonic() - start, 4)
+                            logger.info(f"{self.provider} first token after {call['ttft']:.2f}s -> {path}")
+                        f.write(chunk)
+                        f.flush()
+                        parts.append(chunk)
+            except LLMError as e:
+                call["ok"] = False
+                call["error"] = str(e)[:300]
+                if strict:
+                    raise
+                return f"{self.error_prefix}: {e}"
+            finally:
+                # 提前退出时关闭生成器，由 _iter_sse 关闭响应、断开连接
+                chunks.close()
+            logger.info(f"{self.provider} stream closed after {time.monotonic() - start:.2f}s -> {path}")
+            text = "".join(parts)
+            self._cache_set(key, text)
+            return text
+
+
+def deepseek_usage(usage):
+    usage = usage or {}
+    return {
+        "prompt_tokens": usage.get("prompt_tokens"),
+        "completion_tokens": usage.get("completion_tokens"),
+        "reasoning_tokens": (usage.get("completion_tokens_details") or {}).get("reasoning_tokens"),
+        "cached_tokens": usage.get("prompt_cache_hit_tokens"),
+    }
+
+
+def gemini_usage(usage):
+    usage = usage or {}
+    return {
+        "prompt_tokens": usage.get("promptTokenCount"),
+        "completion_tokens": usage.get("candidatesTokenCount"),
+        "reasoning_tokens": usage.get("thoughtsTokenCount"),
+        "cached_tokens": usage.get("cachedContentTokenCount"),
+    }
+
+
+class GeminiClient(BaseClient):
+    provider = "gemini"
+    error_prefix = "API Error"
+
+    def __init__(self, api_key, model="gemini-2.0-flash", base_url=None, **kwargs):
+        super().__init__(api_key, model, **kwargs)
+        base = f"{base_url or GEMINI_BASE_URL}/v1beta/models/{self.model}"
+        self.url = f"{base}:generateContent?key={self.api_key}"
+        self.stream_url = f"{base}:streamGenerateContent?alt=sse&key={self.api_key}"
+
+    def _payload(self, prompt, system_instruction=None, history=None):
+        if history:
+            contents = [{"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+                        for m in history]
+            contents.append({"role": "user", "parts": [{"text": prompt}]})
+        else:
+            contents = [{"parts": [{"text": prompt}]}]
         payload = {
-            "contents": [{"parts": [{"text": prompt}]}]
+            "contents": contents
         }
         if system_instruction:
             payload["system_instruction"] = {"parts": [{"text": system_instruction}]}
+        return payload
 
-        response = requests.post(self.url, headers={"Content-Type": "application/json"}, data=json.dumps(payload))
-        if response.status_code == 200:
-            result = response.json()
-            try:
-                return result['candidates'][0]['content']['parts'][0]['text']
-            except (KeyError, IndexError):
-                return f"Error parsing response: {result}"
-        return f"API Error: {response.status_code} - {response.text}"
+    def generate_stream(self, prompt, system_instruction=None, call=None, history=None, cancel=None):
+        """逐块产出生成的文本，失败时抛出 LLMError，cancel 被置位时抛出 LLMCancelled"""
+        response = self._post(self.stream_url, self._payload(prompt, system_instruction, history), stream=True, call=call)
+        for event in self._iter_sse(response, cancel):
+            if call is not None and event.get("usageMetadata"):
+                call.update(gemini_usage(event["usageMetadata"]))
+            for candidate in event.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    if part.get("text"):
+                        yield part["text"]
 
-class DeepSeekClient:
-    def __init__(self, api_key, model="deepseek-chat"):
-        self.api_key = api_key
-        self.model = model
-        self.url = "https://api.deepseek.com/chat/completions"
+    def _generate(self, prompt, system_instruction=None, call=None, history=None):
+        result = self._post(self.url, self._payload(prompt, system_instruction, history), call=call).json()
+        if call is not None:
+            call.update(gemini_usage(result.get("usageMetadata")))
+        try:
+            return result['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError):
+            raise LLMError(f"Error parsing response: {result}")
+
+class DeepSeekClient(BaseClient):
+    provider = "deepseek"
+    error_prefix = "DeepSeek API Error"
+
+    def __init__(self, api_key, model="deepseek-chat", base_url=None, **kwargs):
+        super().__init__(api_key, model, **kwargs)
+        self.url = f"{base_url or DEEPSEEK_BASE_URL}/chat/completions"
 
-    def generate(self, prompt, system_instruction=None):
+    def _payload(self, prompt, system_instruction=None, stream=False, history=None):
         messages = []
         if system_instruction:
             messages.append({"role": "system", "content": system_instruction})
+        # 历史中只有 content，reasoner 的 reasoning_content 不回传（API 要求）
+        messages.extend({"role": m["role"], "content": m["content"]} for m in history or ())
         messages.append({"role": "user", "content": prompt})
 
         payload = {
             "model": self.model,
             "messages": messages,
-            "stream": False
+            "stream": stream
         }
-        
-        headers = {
-            "Content-Type": "application/json",
+        if stream:
+            # 最后一个 chunk 携带本次调用的 usage
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def _headers(self):
+        return {
             "Authorization": f"Bearer {self.api_key}"
         }
 
-        response = requests.post(self.url, headers=headers, data=json.dumps(payload))
-        if response.status_code == 200:
-            result = response.json()
+    def generate_stream(self, prompt, system_instruction=None, call=None, history=None, cancel=None):
+        """逐块产出生成的文本（reasoner 的思考过程 reasoning_content 不输出），失败时抛出 LLMError
+
+        cancel 在每个事件上检查，思考阶段没有正文输出时也能及时中止。
+        """
+        payload = self._payload(prompt, system_instruction, stream=True, history=history)
+        response = self._post(self.url, payload, headers=self._headers(), stream=True, call=call)
+        for event in self._iter_sse(response, cancel):
+            if call is not None and event.get("usage"):
+                call.update(deepseek_usage(event["usage"]))
+            for choice in event.get("choices", [])[:1]:
+                text = (choice.get("delta") or {}).get("content")
+                if text:
+                    yield text
+
+    def _generate(self, prompt, system_instruction=None, call=None, history=None):
+        payload = self._payload(prompt, system_instruction, history=history)
+        result = self._post(self.url, payload, headers=self._headers(), call=call).json()
+        if call is not None:
+            call.update(deepseek_usage(result.get("usage")))
+        try:
             return result['choices'][0]['message']['content']
-        return f"DeepSeek API Error: {response.status_code} - {response.text}"
+        except (KeyError, IndexError):
+            raise LLMError(f"Error parsing response: {result}")
+
+
+PROVIDERS = {
+    "gemini": (GeminiClient, "GEMINI_API_KEY"),
+    "deepseek": (DeepSeekClient, "DEEPSEEK_API_KEY"),
+}
+
+
+def create_client(provider, config, model=None, cache_mode="use"):
+    """根据 config.json 中对应 Provider 的配置（模型、限流、重试、缓存）创建客户端"""
+    cls, env_key = PROVIDERS[provider]
+    section = config.get(provider, {})
+    kwargs = {
+        "rate_limit": section.get("rate_limit"),
+        "max_retries": section.get("max_retries", DEFAULT_MAX_RETRIES),
+        "cache": DiskCache.from_config(config.get("cache")),
+        "cache_mode": cache_mode,
+    }
+    model = model or section.get("model")
+    if model:
+        kwargs["model"] = model
+    return cls(os.getenv(env_key), **kwargs)
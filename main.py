@@ -1,229 +1,199 @@
 import os
 import re
-import markdown
-import subprocess
-import time
 import json
 import datetime
+import threading
+import argparse
 from dotenv import load_dotenv
-from llm_client import GeminiClient, DeepSeekClient
+from llm_client import LLMError, create_client, llm_stage
+from scheduler import ProviderScheduler
+from renderer import render_markdown
+from metrics import recorder
 from wechat_client import WeChatClient
+from manifest_store import ManifestStore
+from job_store import JobStore
+from dedup_index import DEDUP_DB_PATH, DedupIndex, check_topic
+from speculative import OutlinePrefetcher, parse_candidates
+from conversation import Conversation, user_turn
+from git_publisher import commit_paths, pages_url
+from prompt_templates import PromptManager
+from site_builder import (generate_index_html, render_article_page, write_if_changed, save_source, write_stylesheet,
+                          write_feeds, precompress)
 
 load_dotenv()
 
 CONFIG_FILE = "config.json"
-RATE_LIMIT_DELAY = 10
+DRAFTS_DIR = "drafts"
 
 def load_config():
     with open(CONFIG_FILE, "r") as f:
         return json.load(f)
 
-class PromptManager:
-    def __init__(self, directory="prompts"):
-        self.directory = directory
-        self.prompts = {}
-        self.load_all()
-
-    def load_all(self):
-        for filename in os.listdir(self.directory):
-            if filename.endswith(".md"):
-                name = filename[:-3]
-                path = os.path.join(self.directory, filename)
-                with open(path, "r", encoding="utf-8") as f:
-                    content = f.read()
-                    self.prompts[name] = self.parse_prompt(content)
-
-    def parse_prompt(self, content):
-        sections = {}
-        current_stage = None
-        lines = content.split('\n')
-        temp_buffer = []
-        for line in lines:
-            if line.startswith("## Stage"):
-                if current_stage:
-                    sections[current_stage] = "\n".join(temp_buffer).strip()
-                current_stage = line.split(":")[0].replace("#", "").strip()
-                temp_buffer = []
-            elif line.startswith("System:"):
-                sections[f"{current_stage}_system"] = line.replace("System:", "").strip()
-            elif line.startswith("User:"):
-                temp_buffer.append(line.replace("User:", "").strip())
-            else:
-                temp_buffer.append(line)
-        if current_stage:
-            sections[current_stage] = "\n".join(temp_buffer).strip()
-        return sections
-
-def update_manifest(title, filename, date_str, keep_existing=True):
-    manifest_path = "articles.json"
-    articles = []
-    if keep_existing and os.path.exists(manifest_path):
-        with open(manifest_path, "r", encoding="utf-8") as f:
-            articles = json.load(f)
-    
-    # Check for duplicates
-    if not any(a['url'] == filename for a in articles):
-        articles.append({
-            "title": title,
-            "url": filename,
-            "date": date_str
-        })
-    
-    # Sort by date descending
-    articles.sort(key=lambda x: (x['date'], x['title']), reverse=True)
-    
-    with open(manifest_path, "w", encoding="utf-8") as f:
-        json.dump(articles, f, ensure_ascii=False, indent=2)
-
-def generate_index_html():
-    """生成带有日历和下拉菜单的门户页面"""
-    index_tpl = """<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <title>微信文章存档</title>
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <style>
-        body { font-family: -apple-system, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; background: #f5f5f5; }
-        .container { background: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
-        h1 { color: #07c160; text-align: center; }
-        .controls { display: flex; gap: 10px; margin-bottom: 20px; justify-content: center; align-items: center; flex-wrap: wrap; }
-        select, input { padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
-        #article-list { list-style: none; padding: 0; }
-        #article-list li { padding: 15px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; }
-        #article-list a { text-decoration: none; color: #333; font-weight: 500; }
-        #article-list a:hover { color: #07c160; }
-        .date { color: #999; font-size: 0.9em; }
-    </style>
-</head>
-<body>
-    <div class="container">
-        <h1>微信文章存档</h1>
-        <div class="controls">
-            <input type="text" id="search-box" placeholder="搜索文章标题...">
-            <label>按日期筛选:</label>
-            <input type="date" id="date-picker">
-            <label>或选择文章:</label>
-            <select id="article-dropdown">
-                <option value="">-- 请选择 --</option>
-            </select>
-        </div>
-        <ul id="article-list"></ul>
-    </div>
-
-    <script>
-        let allArticles = [];
-        
-        async function loadArticles() {
-            const res = await fetch('articles.json');
-            allArticles = await res.json();
-            renderList(allArticles);
-            populateDropdown(allArticles);
-        }
-
-        function renderList(articles) {
-            const list = document.getElementById('article-list');
-            list.innerHTML = articles.map(a => `
-                <li>
-                    <a href="${a.url}">${a.title}</a>
-                    <span class="date">${a.date}</span>
-                </li>
-            `).join('');
-        }
-
-        function populateDropdown(articles) {
-            const dropdown = document.getElementById('article-dropdown');
-            dropdown.innerHTML = '<option value="">-- 请选择 --</option>';
-            articles.forEach(a => {
-                const opt = document.createElement('option');
-                opt.value = a.url;
-                opt.textContent = a.title;
-                dropdown.appendChild(opt);
-            });
-        }
-
-        function filterArticles() {
-            const searchTerm = document.getElementById('search-box').value.toLowerCase();
-            const selectedDate = document.getElementById('date-picker').value;
-            
-            const filtered = allArticles.filter(a => {
-                const matchesSearch = a.title.toLowerCase().includes(searchTerm);
-                const matchesDate = selectedDate ? a.date === selectedDate : true;
-                return matchesSearch && matchesDate;
-            });
-            
-            renderList(filtered);
-        }
-
-        document.getElementById('search-box').addEventListener('input', filterArticles);
-        document.getElementById('date-picker').addEventListener('change', filterArticles);
-
-        document.getElementById('article-dropdown').addEventListener('change', (e) => {
-            if (e.target.value) window.location.href = e.target.value;
-        });
-
-        loadArticles();
-    </script>
-</body>
-</html>"""
-    with open("index.html", "w", encoding="utf-8") as f:
-        f.write(index_tpl)
-
-def deploy_to_github(filename, content_html, title, date_str, keep_existing=True):
+def site_config():
+    """config.json 的 site 段（url、title、feed_items）；没有配置文件时返回空字典
+
+    url 留空时由 export_feeds 推断 GitHub Pages 地址。
+    """
+    try:
+        return load_config().get("site", {})
+    except FileNotFoundError:
+        return {}
+
+def add_cache_arguments(parser):
+    parser.add_argument("--no-cache", action="store_const", const="bypass", dest="cache_mode", default="use",
+                        help="不读也不写 LLM 输出缓存")
+    parser.add_argument("--refresh-cache", action="store_const", const="refresh", dest="cache_mode",
+                        help="忽略已有缓存重新生成，并写入新结果")
+
+def add_conversation_argument(parser):
+    parser.add_argument("--conversation", action="store_true",
+                        help="各阶段作为同一段对话发送：后续阶段的历史命中前缀缓存、预填充更快，"
+                             "但输入 token 总数约翻倍、计费通常更高（配合 --profile 查看 cached）")
+
+def add_profile_argument(parser):
+    parser.add_argument("--profile", action="store_true",
+                        help="运行结束时打印各阶段耗时与 token 汇总（明细见 metrics/events.jsonl）")
+
+def draft_path(title, name):
+    """流式输出时各阶段草稿的落盘路径: drafts/<标题>/<name>"""
+    clean_title = re.sub(r'[\\/:*?"<>|]', '_', title)
+    return os.path.join(DRAFTS_DIR, clean_title, name)
+
+_manifest_store = None
+
+def get_manifest_store():
+    global _manifest_store
+    if _manifest_store is None:
+        _manifest_store = ManifestStore()
+    return _manifest_store
+
+_job_store = None
+
+def get_job_store():
+    global _job_store
+    if _job_store is None:
+        _job_store = JobStore()
+    return _job_store
+
+_dedup_index = None
+
+def get_dedup_index():
+    global _dedup_index
+    if _dedup_index is None:
+        # 先打开 ManifestStore，保证 articles 表已建好（并已从 articles.json 迁移）
+        _dedup_index = DedupIndex(DEDUP_DB_PATH, get_manifest_store().db_path)
+    return _dedup_index
+
+def check_duplicate(title, angle=""):
+    """发布前查重：返回 (None / "warn" / "skip", 匹配列表)，阈值取 config.json 的 dedup 段"""
+    try:
+        section = load_config().get("dedup", {})
+    except FileNotFoundError:
+        section = {}
+    return check_topic(get_dedup_index(), title, angle, section.get("warn", 0.6), section.get("skip", 0.8))
+
+def print_duplicates(title, matches):
+    for similarity, matched, url in matches:
+        print(f"[查重] 《{title}》与已发布文章相似 ({similarity:.2f}): {matched} ({url})")
+
+def update_manifest(title, filename, date_str, keep_existing=True, export=True):
+    """登记文章并返回写出的文件；批量发布时传 export=False，最后调用一次 export_site()"""
+    store = get_manifest_store()
+    if not keep_existing:
+        store.clear()
+    store.add(title, filename, date_str)
+    # 查重索引在部署时同步：首次为已有存档建索引的开销不会落在交互式选题时
+    get_dedup_index().sync()
+    if export:
+        return export_manifest()
+    return []
+
+def export_manifest():
+    store = get_manifest_store()
+    with recorder.timed("deploy", "export_manifest"):
+        return store.export_json() + store.export_shards()
+
+def export_feeds():
+    """按 manifest 流式生成 sitemap.xml 与 feed.xml
+
+    站点地址取 site.url，未配置时按 CNAME 或 git remote 推断 GitHub Pages 地址；都拿不到时提示并跳过。
+    """
+    site = site_config()
+    url = site.get("url") or pages_url()
+    if not url:
+        print("[Deploy] 未配置 site.url，也无法从 CNAME / git remote 推断站点地址，跳过 sitemap.xml 与 feed.xml")
+        return []
+    with recorder.timed("deploy", "export_feeds"):
+        return write_feeds(get_manifest_store(), url, site.get("title", "微信文章存档"), site.get("feed_items", 20))
+
+def export_site():
+    """导出 manifest、门户页面、共享样式表与 sitemap/RSS，并生成 .gz/.br 压缩版本；返回写出的文件路径"""
+    stylesheet = write_stylesheet()
+    paths = export_manifest() + [generate_index_html()] + export_feeds()
+    with recorder.timed("deploy", "precompress"):
+        # 样式表带内容哈希、只写一次，用最高压缩率；其余文件每次发布都会重写，用快速档
+        return stylesheet + paths + precompress(stylesheet) + precompress(paths, fast=True)
+
+def deploy_to_github(filename, content_html, title, date_str, keep_existing=True, export=True, batch=None,
+                     source_md=None):
+    """写出文章页面并登记到 manifest；给出 source_md 时同时保存 Markdown 源稿供 rebuild 使用
+
+    传入 batch (git_publisher.GitBatch) 时只收集写出的路径，由调用方整批提交一次；
+    否则立即只提交本篇涉及的文件。
+    """
     print("\n[Deploy] 正在准备部署文件...")
+    with recorder.timed("deploy", "deploy_to_github"):
+        _deploy(filename, content_html, title, date_str, keep_existing, export, batch, source_md)
+
+def _deploy(filename, content_html, title, date_str, keep_existing, export, batch, source_md):
     target_path = os.path.basename(filename)
     
-    with open(target_path, "w", encoding="utf-8") as f:
-        f.write(f"""<!DOCTYPE html>
-<html>
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title}</title>
-    <style>
-        body {{ font-family: -apple-system, system-ui, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; color: #333; }}
-        h1 {{ border-bottom: 2px solid #07c160; padding-bottom: 10px; }}
-        .meta {{ color: #999; margin-bottom: 20px; }}
-        strong {{ color: #07c160; }}
-        blockquote {{ border-left: 4px solid #eee; padding-left: 20px; color: #666; font-style: italic; }}
-    </style>
-</head>
-<body>
-    <h1>{title}</h1>
-    <div class="meta">发布日期: {date_str}</div>
-    {content_html}
-    <hr>
-    <p><a href="index.html">← 返回首页</a></p>
-</body>
-</html>""")
-
-    update_manifest(title, os.path.basename(filename), date_str, keep_existing)
-    generate_index_html()
+    write_if_changed(target_path, render_article_page(title, date_str, content_html))
 
-    try:
-        subprocess.run(["git", "add", "."], check=True)
-        subprocess.run(["git", "commit", "-m", f"Add article: {title}"], check=True)
-        # We don't push here in a local environment because it might mess up branches
-        # This will be handled by the specialized GitHub Action
-        print(f"本地文件已提交。")
-    except Exception as e:
-        print(f"Git 发布失败: {e}")
+    paths = [target_path]
+    if source_md is not None:
+        paths.append(save_source(target_path, title, date_str, source_md))
+    paths += update_manifest(title, os.path.basename(filename), date_str, keep_existing, export=False)
+    if export:
+        paths += export_site()
+    paths += precompress([target_path])
+
+    if batch is not None:
+        batch.add(*paths)
+    else:
+        commit_paths(paths, f"Add article: {title}")
 
 def main():
+    parser = argparse.ArgumentParser()
+    add_cache_arguments(parser)
+    add_profile_argument(parser)
+    parser.add_argument("--speculate", type=int, default=0, metavar="N",
+                        help="挑选标题期间在后台为前 N 个候选预先生成大纲（默认关闭）")
+    add_conversation_argument(parser)
+    args = parser.parse_args()
+
     config = load_config()
     pm = PromptManager()
+    # 索引平时在部署时同步；尚未建过索引的旧存档在此后台补建，与 Stage 1 生成并行，不阻塞选题时的查重
+    threading.Thread(target=get_dedup_index().sync, name="dedup-sync", daemon=True).start()
     
     # 自动选择 Provider 和 Model (根据配置)
-    if config["default_provider"] == "2":
+    # 限流与重试由客户端按 config.json 中的 rate_limit / max_retries 处理
+    # default_provider 为 "auto" 时由调度器按各后端健康度路由每个阶段，并在失败时自动切换
+    if config["default_provider"] == "auto":
+        provider_name = "Auto"
+        try:
+            llm = ProviderScheduler.from_config(config, cache_mode=args.cache_mode)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+    elif config["default_provider"] == "2":
         provider_name = "DeepSeek"
-        api_key = os.getenv("DEEPSEEK_API_KEY")
-        selected_model = config["deepseek"]["model"]
-        llm = DeepSeekClient(api_key, model=selected_model)
+        llm = create_client("deepseek", config, cache_mode=args.cache_mode)
     else:
         provider_name = "Gemini"
-        api_key = os.getenv("GEMINI_API_KEY")
-        selected_model = config["gemini"]["model"]
-        llm = GeminiClient(api_key, model=selected_model)
+        llm = create_client("gemini", config, cache_mode=args.cache_mode)
+    selected_model = llm.model
 
     print(f"--- 自动识别配置: {provider_name} ({selected_model}) ---")
 
@@ -237,28 +207,75 @@ def main():
     topic = input("\n请输入初步选题方向: ")
 
     # 运行流程
+    # strict=True: 失败直接中止，不把错误信息当作正文传给下一阶段
     stage1_prompt = prompts["Stage 1"].format(topic=topic)
-    titles_output = llm.generate(stage1_prompt, system_instruction=prompts.get("Stage 1_system"))
+    # 对话模式：Stage 1 的系统提示作为整段对话的固定前缀，各阶段依次追加
+    chat = Conversation(llm, prompts.get("Stage 1_system")) if args.conversation else None
+    try:
+        with llm_stage("Stage 1"):
+            if chat:
+                titles_output = chat.send(stage1_prompt, strict=True)
+            else:
+                titles_output = llm.generate(stage1_prompt, system_instruction=prompts.get("Stage 1_system"), strict=True)
+    except LLMError as e:
+        print(f"Error: {e}")
+        return
     print("\n" + titles_output)
 
+    prefetcher = None
+    if args.speculate > 0:
+        candidates = parse_candidates(titles_output)
+        if candidates:
+            prefetcher = OutlinePrefetcher(llm, prompts, candidates, limit=args.speculate, conversation=chat,
+                                           path_for=lambda title: draft_path(title, "outline.md"))
+            print(f"(已在后台为 {len(prefetcher)} 个候选标题预先生成大纲)")
+
     selected_title = input("\n请复制选定的【标题】: ")
-    selected_angle = input("请简述选定的【切入点/心理学概念】: ")
+    default_angle = prefetcher.angle_for(selected_title) if prefetcher else ""
+    if default_angle:
+        selected_angle = input(f"请简述选定的【切入点/心理学概念】(回车使用: {default_angle}): ") or default_angle
+    else:
+        selected_angle = input("请简述选定的【切入点/心理学概念】: ")
 
-    # Stages...
-    def generate_step(stage, prompt_key, **kwargs):
-        if config["default_provider"] != "2":
-            time.sleep(RATE_LIMIT_DELAY)
-        print(f"[{stage}/4] 正在处理...")
-        return llm.generate(prompts[prompt_key].format(**kwargs))
+    # 在花费三次 reasoner 调用之前先查重
+    level, matches = check_duplicate(selected_title, selected_angle)
+    print_duplicates(selected_title, matches)
+    if level == "skip" and input("选题与已发布文章高度重复，仍要继续吗? (y/N): ").strip().lower() != "y":
+        if prefetcher:
+            prefetcher.close()
+        return
 
-    outline = generate_step(2, "Stage 2", title=selected_title, angle=selected_angle)
-    content = generate_step(3, "Stage 3", outline=outline)
-    final_md = generate_step(4, "Stage 4", content=content)
+    # Stages 2-4 流式生成，输出边生成边写入 drafts/<标题>/，长时间的 reasoner 调用中途可查看进度
+    def generate_step(stage, prompt_key, draft, **kwargs):
+        path = draft_path(selected_title, draft)
+        print(f"[{stage}/4] 正在处理... (实时写入 {path})")
+        with llm_stage(prompt_key):
+            if chat:
+                return chat.send(user_turn(prompts, prompt_key, **kwargs), strict=True, path=path)
+            return llm.generate_to_file(prompts[prompt_key].format(**kwargs), path, strict=True)
+
+    try:
+        prompt, outline = prefetcher.take(selected_title, selected_angle) if prefetcher else (None, None)
+        if outline is not None:
+            print("[2/4] 使用预先生成的大纲")
+            if chat:
+                # 记录预取时实际发出的 prompt，后续阶段的前缀与提供方已缓存的逐字一致
+                chat.append(prompt, outline)
+        else:
+            outline = generate_step(2, "Stage 2", "outline.md", title=selected_title, angle=selected_angle)
+        content = generate_step(3, "Stage 3", "content.md", outline=outline)
+        final_md = generate_step(4, "Stage 4", "final.md", content=content)
+    except LLMError as e:
+        print(f"Error: {e}")
+        return
 
-    html_content = markdown.markdown(final_md, extensions=['extra'])
+    with recorder.timed("render", "render_markdown"):
+        html_content = render_markdown(final_md)
     date_str = datetime.datetime.now().strftime("%Y-%m-%d")
     clean_title = re.sub(r'[\\/:*?"<>|]', '_', selected_title)
-    deploy_to_github(f"{clean_title}.html", html_content, selected_title, date_str)
+    deploy_to_github(f"{clean_title}.html", html_content, selected_title, date_str, source_md=final_md)
+    if args.profile:
+        print(recorder.summary())
 
 if __name__ == "__main__":
     main()
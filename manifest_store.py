@@ -0,0 +1,191 @@
+import json
+import os
+import sqlite3
+import threading
+
+DB_PATH = "articles.db"
+MANIFEST_PATH = "articles.json"
+SHARD_DIR = "manifest"
+SEARCH_DIR = "search"
+# 倒排索引按 gram 哈希分片：每片约覆盖这么多篇标题，分片数取 2 的幂，上限 MAX_SEARCH_SHARDS
+SEARCH_SHARD_TITLES = 500
+MAX_SEARCH_SHARDS = 256
+
+
+def title_grams(title):
+    """标题的单字集合与相邻二字组合集合（中文按字切分，无需分词），返回 (单字, 二字)"""
+    text = title.lower()
+    return set(text), {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def gram_shard(gram, shards):
+    """gram 所属的倒排索引分片；与门户页面中的 gramShard 逐位一致（按码点计算，32 位回绕）"""
+    h = 0
+    for ch in gram:
+        h = (h * 31 + ord(ch)) & 0xFFFFFFFF
+    return h % shards
+
+
+def search_shard_count(total):
+    shards = 1
+    while shards < MAX_SEARCH_SHARDS and shards * SEARCH_SHARD_TITLES < total:
+        shards *= 2
+    return shards
+
+
+def _delta_encode(ids):
+    """升序编号列表改存相邻差值，JSON 体积约减半"""
+    return [b - a for a, b in zip([0] + ids, ids)]
+
+
+class ManifestStore:
+    """文章索引：SQLite 主键保证按 URL O(1) 去重，(date, title) 索引保证有序读取，articles.json 只在需要时导出"""
+
+    def __init__(self, db_path=DB_PATH, manifest_path=MANIFEST_PATH):
+        self.db_path = db_path
+        self.manifest_path = manifest_path
+        self.lock = threading.Lock()
+        fresh = not os.path.exists(db_path)
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS articles ("
+            " url TEXT PRIMARY KEY, title TEXT NOT NULL, date TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_articles_order ON articles (date DESC, title DESC)")
+        self.conn.commit()
+        # 首次使用时从已有的 articles.json 迁移（例如从 gh-pages 检出的旧站点）
+        if fresh and os.path.exists(manifest_path):
+            self.import_json(manifest_path)
+
+    def import_json(self, path):
+        with open(path, "r", encoding="utf-8") as f:
+            articles = json.load(f)
+        with self.lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO articles (url, title, date) VALUES (?, ?, ?)",
+                ((a["url"], a["title"], a["date"]) for a in articles),
+            )
+
+    def add(self, title, url, date_str):
+        """插入一篇文章，URL 已存在时忽略；返回是否为新文章"""
+        with self.lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT OR IGNORE INTO articles (url, title, date) VALUES (?, ?, ?)",
+                (url, title, date_str),
+            )
+        return cur.rowcount == 1
+
+    def contains(self, url):
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM articles WHERE url = ?", (url,)).fetchone() is not None
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM articles")
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+
+    def iter_sorted(self):
+        """按日期、标题倒序逐条产出，不一次性载入全部文章"""
+        cur = self.conn.cursor()
+        cur.execute("SELECT title, url, date FROM articles ORDER BY date DESC, title DESC")
+        for title, url, date_str in cur:
+            yield {"title": title, "url": url, "date": date_str}
+
+    def export_json(self, path=None):
+        path = path or self.manifest_path
+        with self.lock:
+            articles = list(self.iter_sorted())
+        _write_json(path, articles)
+        return [path]
+
+    def export_shards(self, directory=SHARD_DIR):
+        """按月导出分片 manifest/<YYYY-MM>.json、月份索引 index.json 与标题倒排索引 search/，返回写入和删除的路径
+
+        文章的全局编号即其在倒序列表中的位置，月份索引记录每个分片的起始编号，
+        门户页面据此把搜索命中的编号映射回需要加载的分片。
+        倒排索引按 gram 哈希分片，二字组合在 b<n>.json，单字只用于一个字的查询、单独放在 u<n>.json；
+        页面只下载查询用到的分片。编号列表差分编码。
+        """
+        os.makedirs(directory, exist_ok=True)
+        written = []
+        months = []
+        unigrams = {}
+        bigrams = {}
+        shard = []
+
+        def flush():
+            if shard:
+                written.append(os.path.join(directory, f"{months[-1]['month']}.json"))
+                _write_json(written[-1], shard, indent=None)
+
+        with self.lock:
+            for doc_id, article in enumerate(self.iter_sorted()):
+                month = article["date"][:7]
+                if not months or months[-1]["month"] != month:
+                    flush()
+                    shard = []
+                    months.append({"month": month, "start": doc_id, "count": 0})
+                shard.append(article)
+                months[-1]["count"] += 1
+                chars, pairs = title_grams(article["title"])
+                for gram in chars:
+                    unigrams.setdefault(gram, []).append(doc_id)
+                for gram in pairs:
+                    bigrams.setdefault(gram, []).append(doc_id)
+            flush()
+
+        total = sum(m["count"] for m in months)
+        shards = search_shard_count(total)
+        written.append(os.path.join(directory, "index.json"))
+        _write_json(written[-1], {"total": total, "months": months, "search_shards": shards}, indent=None)
+        written += _export_postings(os.path.join(directory, SEARCH_DIR), shards, {"u": unigrams, "b": bigrams})
+
+        # 清理已不存在的月份分片（以及旧版的整体索引 search.json）
+        keep = {f"{m['month']}.json" for m in months} | {"index.json"}
+        for name in os.listdir(directory):
+            if name.endswith(".json") and name not in keep:
+                written.append(os.path.join(directory, name))
+                os.remove(written[-1])
+        return written
+
+    def close(self):
+        self.conn.close()
+
+
+def _export_postings(directory, shards, kinds):
+    """按 gram 哈希把 {前缀: 倒排表} 写成 <前缀><n>.json 分片，删除分片数变化后多余的旧文件，返回写入和删除的路径"""
+    os.makedirs(directory, exist_ok=True)
+    written = []
+    keep = set()
+    for prefix, postings in kinds.items():
+        parts = [{} for _ in range(shards)]
+        for gram, ids in postings.items():
+            parts[gram_shard(gram, shards)][gram] = _delta_encode(ids)
+        for n, part in enumerate(parts):
+            keep.add(f"{prefix}{n}.json")
+            written.append(os.path.join(directory, f"{prefix}{n}.json"))
+            _write_json(written[-1], part, indent=None)
+    for name in os.listdir(directory):
+        if name.endswith(".json") and name not in keep:
+            written.append(os.path.join(directory, name))
+            os.remove(written[-1])
+    return written
+
+
+def _write_json(path, data, indent=2):
+    """原子写入；内容未变时不改动文件，保留 mtime 以便跳过重新压缩"""
+    separators = None if indent else (",", ":")
+    text = json.dumps(data, ensure_ascii=False, indent=indent, separators=separators).encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == text:
+                return
+    except FileNotFoundError:
+        pass
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(text)
+    os.replace(tmp, path)
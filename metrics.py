@@ -0,0 +1,123 @@
+import atexit
+import datetime
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_DIR = os.getenv("WECHATOA_METRICS_DIR", "metrics")
+EVENTS_FILE = "events.jsonl"
+PROM_FILE = "wechatoa.prom"
+
+# 汇总到 Prometheus 时累加的数值字段
+SUM_FIELDS = ("prompt_tokens", "completion_tokens", "reasoning_tokens", "cached_tokens", "retries")
+
+
+class MetricsRecorder:
+    """记录每次 LLM 调用、渲染、部署步骤的耗时与 token 用量
+
+    事件即时追加到 metrics/events.jsonl，进程退出时把本次运行的汇总写成 Prometheus 文本格式。
+    """
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.run_id = datetime.datetime.now().strftime("%Y%m%dT%H%M%S") + f"-{os.getpid()}"
+        self.events = []
+        self.lock = threading.Lock()
+        self._registered = False
+
+    def record(self, kind, name, **fields):
+        event = {"ts": round(time.time(), 3), "run": self.run_id, "kind": kind, "name": name}
+        event.update((k, v) for k, v in fields.items() if v is not None)
+        line = json.dumps(event, ensure_ascii=False)
+        with self.lock:
+            self.events.append(event)
+            os.makedirs(self.directory, exist_ok=True)
+            with open(os.path.join(self.directory, EVENTS_FILE), "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+            if not self._registered:
+                atexit.register(self.write_prometheus)
+                self._registered = True
+        return event
+
+    @contextmanager
+    def timed(self, kind, name, **fields):
+        """计时一个步骤；with 块内可往产出的 dict 中补充字段（token、重试次数等）"""
+        start = time.monotonic()
+        fields = dict(fields, ok=True)
+        try:
+            yield fields
+        except BaseException as e:
+            fields["ok"] = False
+            fields["error"] = f"{type(e).__name__}: {e}"[:300]
+            raise
+        finally:
+            if fields.get("ok") is False and "error" not in fields:
+                fields["error"] = "failed"
+            self.record(kind, name, seconds=round(time.monotonic() - start, 4), **fields)
+
+    def _aggregate(self):
+        groups = {}
+        with self.lock:
+            events = list(self.events)
+        for e in events:
+            key = (e["kind"], e["name"], e.get("stage") or "", e.get("model") or "")
+            g = groups.setdefault(key, dict({f: 0 for f in SUM_FIELDS}, count=0, errors=0, seconds=0.0,
+                                            ttft_sum=0.0, ttft_count=0, cache_hits=0))
+            g["count"] += 1
+            g["errors"] += 0 if e.get("ok", True) else 1
+            g["seconds"] += e.get("seconds", 0.0)
+            g["cache_hits"] += 1 if e.get("cache_hit") else 0
+            if e.get("ttft") is not None:
+                g["ttft_sum"] += e["ttft"]
+                g["ttft_count"] += 1
+            for f in SUM_FIELDS:
+                g[f] += e.get(f) or 0
+        return groups
+
+    def write_prometheus(self, path=None):
+        groups = self._aggregate()
+        if not groups:
+            return
+        path = path or os.path.join(self.directory, PROM_FILE)
+        series = [
+            ("wechatoa_step_total", "counter", "Number of calls", "count"),
+            ("wechatoa_step_errors_total", "counter", "Number of failed calls", "errors"),
+            ("wechatoa_step_seconds_total", "counter", "Wall time spent", "seconds"),
+            ("wechatoa_llm_ttft_seconds_total", "counter", "Sum of time-to-first-token", "ttft_sum"),
+            ("wechatoa_llm_cache_hits_total", "counter", "Calls served from the local cache", "cache_hits"),
+        ] + [
+            (f"wechatoa_llm_{f}_total", "counter", f"Sum of {f.replace('_', ' ')}", f) for f in SUM_FIELDS
+        ]
+        lines = []
+        for metric, mtype, help_text, field in series:
+            lines.append(f"# HELP {metric} {help_text}")
+            lines.append(f"# TYPE {metric} {mtype}")
+            for (kind, name, stage, model), g in sorted(groups.items()):
+                labels = f'kind="{kind}",name="{name}",stage="{stage}",model="{model}"'
+                lines.append(f"{metric}{{{labels}}} {g[field]:g}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp, path)
+
+    def summary(self):
+        """--profile 使用的文本汇总"""
+        groups = self._aggregate()
+        header = f"{'kind':<8}{'stage':<17}{'name':<34}{'n':>4}{'total s':>10}{'avg s':>9}{'ttft s':>9}" \
+                 f"{'prompt':>9}{'compl':>9}{'reason':>9}{'cached':>9}{'retry':>6}{'err':>5}"
+        lines = ["--- Profile ---", header]
+        for (kind, name, stage, model), g in sorted(groups.items(), key=lambda kv: -kv[1]["seconds"]):
+            label = f"{name} ({model})" if model else name
+            ttft = f"{g['ttft_sum'] / g['ttft_count']:.2f}" if g["ttft_count"] else "-"
+            lines.append(
+                f"{kind:<8}{(stage or '-')[:16]:<17}{label[:33]:<34}{g['count']:>4}{g['seconds']:>10.2f}"
+                f"{g['seconds'] / g['count']:>9.2f}{ttft:>9}{g['prompt_tokens']:>9}{g['completion_tokens']:>9}"
+                f"{g['reasoning_tokens']:>9}{g['cached_tokens']:>9}{g['retries']:>6}{g['errors']:>5}"
+            )
+        return "\n".join(lines)
+
+
+recorder = MetricsRecorder()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+# 模拟生成的正文：带小标题，便于按章节拆分等流程使用
+# 各段带上请求编号，每次生成的内容都不相同，后续阶段的 prompt 不会因内容雷同而意外命中前缀缓存
+SAMPLE_SECTION = "## 小标题 {n}\n\n这是第 {request} 次请求模拟生成的第 {n} 段正文，**重点内容**会加粗显示，用于压测渲染与部署流程。\n\n"
+# 前缀缓存按 64 token 为单位命中（与 DeepSeek 一致）；mock 按 1 个字符 1 个 token 估算
+CACHE_UNIT = 64
+# 注入的微信接口错误：HTTP 状态仍为 200，错误放在 errcode 中；40001 会触发客户端刷新 token 后重试
+WECHAT_ERRORS = {
+    -1: "system error",
+    40001: "invalid credential, access_token is invalid or not latest",
+    45009: "reach max api daily quota limit",
+}
+
+
+class MockConfig:
+    """mock 服务的行为参数
+
+    latency: 每个请求返回首字节前的等待（秒）；chunk_delay: 流式响应每块之间的间隔；
+    chunks: 每次生成的段落数；reasoning: DeepSeek 流式响应在正文前发送的 reasoning_content 块数（模拟 reasoner 的思考阶段）；
+    error_rate: 以 429/500 响应的请求比例（Retry-After 为 retry_after 秒）。
+    """
+
+    def __init__(self, latency=0.2, chunk_delay=0.01, chunks=6, error_rate=0.0, retry_after=0, seed=None, reasoning=1):
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunks = chunks
+        self.reasoning = reasoning
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.generated = 0
+        self.prefixes = deque(maxlen=256)
+
+    def should_fail(self):
+        with self.lock:
+            self.requests += 1
+            return self.random.random() < self.error_rate
+
+    def prompt_usage(self, text):
+        """模拟提供方的前缀缓存：返回 (输入 token 数, 命中缓存的 token 数)，命中部分是与此前请求的最长公共前缀"""
+        with self.lock:
+            hit = max((len(os.path.commonprefix([text, seen])) for seen in self.prefixes), default=0)
+            self.prefixes.append(text)
+        return len(text), hit // CACHE_UNIT * CACHE_UNIT
+
+    def pieces(self):
+        with self.lock:
+            self.generated += 1
+            request = self.generated
+        return [SAMPLE_SECTION.format(n=i + 1, request=request) for i in range(self.chunks)]
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "WechatoaMock/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def config(self):
+        return self.server.config
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _json(self, data, status=200, headers=None):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sse(self, events):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for event in events:
+                payload = event if isinstance(event, str) else json.dumps(event, ensure_ascii=False)
+                data = f"data: {payload}\n\n".encode("utf-8")
+                self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+                self.wfile.flush()
+                time.sleep(self.config.chunk_delay)
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # 客户端中途断开（如取消的预取），与真实接口一样停止生成
+            self.close_connection = True
+
+    def _maybe_fail(self, wechat=False):
+        if self.config.should_fail():
+            if wechat:
+                errcode = self.config.random.choice(sorted(WECHAT_ERRORS))
+                self._json({"errcode": errcode, "errmsg": WECHAT_ERRORS[errcode]})
+                return True
+            status = self.config.random.choice([429, 500])
+            headers = {"Retry-After": str(self.config.retry_after)} if status == 429 else {}
+            self._json({"error": {"message": "injected failure"}}, status=status, headers=headers)
+            return True
+        return False
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/cgi-bin/token":
+            time.sleep(self.config.latency)
+            return self._json({"access_token": f"mock-{uuid.uuid4().hex[:12]}", "expires_in": 7200})
+        self._json({"error": "not found"}, status=404)
+
+    def do_POST(self):
+        body = self._read_body()
+        path = urlparse(self.path).path
+        time.sleep(self.config.latency)
+        if path.startswith("/cgi-bin/"):
+            if self._maybe_fail(wechat=True):
+                return
+            return self._wechat(path)
+        if self._maybe_fail():
+            return
+        if path == "/chat/completions":
+            return self._deepseek(json.loads(body or b"{}"))
+        match = re.match(r"/v1beta/models/([^:]+):(generateContent|streamGenerateContent)$", path)
+        if match:
+            return self._gemini(json.loads(body or b"{}"), match.group(2) == "streamGenerateContent")
+        self._json({"error": "not found"}, status=404)
+
+    def _deepseek(self, payload):
+        pieces = self.config.pieces()
+        prompt = "".join(f"{m.get('role')}\n{m.get('content')}\n" for m in payload.get("messages", []))
+        prompt_tokens, cached = self.config.prompt_usage(prompt)
+        usage = {
+            "prompt_tokens": prompt_tokens, "completion_tokens": 600,
+            "completion_tokens_details": {"reasoning_tokens": 200},
+            "prompt_cache_hit_tokens": cached, "prompt_cache_miss_tokens": prompt_tokens - cached,
+        }
+        if not payload.get("stream"):
+            return self._json({"choices": [{"message": {"role": "assistant", "content": "".join(pieces)}}], "usage": usage})
+        events = [{"choices": [{"delta": {"reasoning_content": "思考中"}}]}] * self.config.reasoning
+        events += [{"choices": [{"delta": {"content": p}}]} for p in pieces]
+        events.append({"choices": [], "usage": usage})
+        events.append("[DONE]")
+        self._sse(events)
+
+    def _gemini(self, payload, stream):
+        pieces = self.config.pieces()
+        turns = [payload.get("system_instruction", {})] + payload.get("contents", [])
+        prompt = "".join(f"{t.get('role', '')}\n{''.join(p.get('text', '') for p in t.get('parts', []))}\n"
+                         for t in turns)
+        prompt_tokens, cached = self.config.prompt_usage(prompt)
+        usage = {"promptTokenCount": prompt_tokens, "candidatesTokenCount": 600, "cachedContentTokenCount": cached}
+        if not stream:
+            return self._json({"candidates": [{"content": {"parts": [{"text": "".join(pieces)}]}}], "usageMetadata": usage})
+        self._sse([{"candidates": [{"content": {"parts": [{"text": p}]}}], "usageMetadata": usage} for p in pieces])
+
+    def _wechat(self, path):
+        if path == "/cgi-bin/draft/add":
+            return self._json({"media_id": f"mock-draft-{uuid.uuid4().hex[:12]}"})
+        if path == "/cgi-bin/media/uploadimg":
+            return self._json({"url": f"http://mmbiz.qpic.cn/mock/{uuid.uuid4().hex[:12]}.jpg"})
+        self._json({"errcode": 404, "errmsg": "not found"})
+
+
+class MockServer:
+    """在后台线程中运行的本地 DeepSeek / Gemini / 微信接口替身"""
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.config = config or MockConfig()
+        self.thread = None
+
+    @property
+    def config(self):
+        return self.httpd.config
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地 LLM / 微信接口 mock 服务")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--chunk-delay", type=float, default=0.01)
+    parser.add_argument("--chunks", type=int, default=6)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--reasoning", type=int, default=1, help="DeepSeek 流式响应中思考过程的块数")
+    args = parser.parse_args()
+    config = MockConfig(args.latency, args.chunk_delay, args.chunks, args.error_rate, reasoning=args.reasoning)
+    server = MockServer(config, port=args.port)
+    print(f"Mock server listening on {server.url}")
+    print(f"  export DEEPSEEK_BASE_URL={server.url} GEMINI_BASE_URL={server.url} WECHAT_BASE_URL={server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
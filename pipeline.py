@@ -0,0 +1,59 @@
+import re
+
+from llm_client import LLMError, llm_stage
+from renderer import render_article
+from metrics import recorder
+from main import deploy_to_github, draft_path
+from job_store import next_stage
+from section_review import draft_names, plan_review, review_sections
+from conversation import Conversation, job_conversation
+
+STAGE_MESSAGES = {
+    "Stage 2": "[1/3] 正在生成大纲 (Reasoner Thinking)...",
+    "Stage 3": "[2/3] 正在撰写正文...",
+    "Stage 4": "[3/3] 正在润色审查...",
+}
+
+
+def deploy_job(job, keep_existing=None, export=True, batch=None):
+    """写出文章页面、登记 manifest 并提交；keep_existing 缺省取任务自身的设置"""
+    clean_title = re.sub(r'[\/:*?"<>|]', '_', job["title"])
+    if keep_existing is None:
+        keep_existing = job["keep_existing"]
+    deploy_to_github(f"{clean_title}.html", job["outputs"]["html"], job["title"], job["date"], keep_existing,
+                     export=export, batch=batch, source_md=job["outputs"]["review"])
+
+
+def run_step(job, llm, prompts, stream=False, section_review=False, max_workers=4, conversation=False,
+             deploy=deploy_job, log=print):
+    """执行任务的下一步，返回 (新状态, 该步输出)，由调用方写入 jobs.db
+
+    同步的 cli_generate.run_job 直接调用，批量模式经 asyncio.to_thread 调用；部署方式由 deploy(job) 决定。
+    LLM 阶段失败时抛出 LLMError，不把错误信息当作正文交给下一阶段。
+    """
+    step = next_stage(job, prompts)
+    if step:
+        state, stage, draft, prompt = step
+        log(STAGE_MESSAGES[stage])
+        calls = plan_review(prompts, job["outputs"]["content"]) if section_review and state == "review" else None
+        if calls:
+            log(f"      分 {len(calls) - 1} 节并发审查，结尾单独处理")
+            paths = [draft_path(job["title"], name) for name in draft_names(calls)] if stream else None
+            text = review_sections(llm, calls, max_workers, paths)
+        else:
+            chat = Conversation(llm)
+            if conversation:
+                chat, prompt = job_conversation(llm, job, prompts)
+            with llm_stage(stage):
+                text = chat.send(prompt, strict=True, path=draft_path(job["title"], draft) if stream else None)
+        if not text.strip():
+            raise LLMError(f"{stage} returned empty output")
+        return state, {state: text}
+    if job["state"] == "review":
+        with recorder.timed("render", "render_article"):
+            html, wechat_html = render_article(job["outputs"]["review"])
+        return "rendered", {"html": html, "wechat_html": wechat_html}
+    log("正在部署...")
+    # 页面写入、manifest 登记和 git 提交都是幂等的，部署中途中断后重跑不会重复
+    deploy(job)
+    return "deployed", {}
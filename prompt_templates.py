@@ -0,0 +1,151 @@
+import os
+import string
+import threading
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 各阶段模板必须且只能使用的占位符
+STAGE_FIELDS = {
+    "Stage 1": frozenset({"topic"}),
+    "Stage 2": frozenset({"title", "angle"}),
+    "Stage 3": frozenset({"outline"}),
+    "Stage 4": frozenset({"content"}),
+    # 可选：分节并发审查（cli_generate --section-review），缺省时退回整篇 Stage 4
+    "Stage 4 Section": frozenset({"section"}),
+    "Stage 4 Ending": frozenset({"ending"}),
+}
+REQUIRED_STAGES = ("Stage 2", "Stage 3", "Stage 4")
+
+_formatter = string.Formatter()
+
+
+class PromptError(ValueError):
+    pass
+
+
+class PromptTemplate(str):
+    """加载时预编译的提示词模板：占位符只解析一次，渲染前校验参数是否齐全"""
+
+    def __new__(cls, text, name=""):
+        obj = super().__new__(cls, text)
+        obj.name = name
+        pieces = []
+        fields = set()
+        try:
+            parsed = list(_formatter.parse(text))
+        except ValueError as e:
+            raise PromptError(f"{name}: 模板语法错误 ({e})")
+        for literal, field, spec, conversion in parsed:
+            if field is not None:
+                if spec or conversion or not field.isidentifier():
+                    raise PromptError(f"{name}: 不支持的占位符 {{{field}}}")
+                fields.add(field)
+            pieces.append((literal, field))
+        obj._pieces = tuple(pieces)
+        obj.fields = frozenset(fields)
+        return obj
+
+    def format(self, **kwargs):
+        missing = self.fields - kwargs.keys()
+        if missing:
+            raise PromptError(f"{self.name} 缺少参数: {', '.join(sorted(missing))}")
+        return "".join(literal + (str(kwargs[field]) if field is not None else "") for literal, field in self._pieces)
+
+
+def parse_prompt(content, name=""):
+    sections = {}
+    current_stage = None
+    lines = content.split('\n')
+    temp_buffer = []
+    for line in lines:
+        if line.startswith("## Stage"):
+            if current_stage:
+                sections[current_stage] = "\n".join(temp_buffer).strip()
+            current_stage = line.split(":")[0].replace("#", "").strip()
+            temp_buffer = []
+        elif line.startswith("System:"):
+            sections[f"{current_stage}_system"] = line.replace("System:", "").strip()
+        elif line.startswith("User:"):
+            temp_buffer.append(line.replace("User:", "").strip())
+        else:
+            temp_buffer.append(line)
+    if current_stage:
+        sections[current_stage] = "\n".join(temp_buffer).strip()
+
+    compiled = {}
+    for key, text in sections.items():
+        if key.endswith("_system"):
+            compiled[key] = text
+        else:
+            compiled[key] = PromptTemplate(text, name=f"{name}/{key}")
+    validate_prompt(compiled, name)
+    return compiled
+
+
+def validate_prompt(sections, name=""):
+    """检查每个阶段的占位符与流水线传入的参数一致，避免运行到一半才因 format 失败"""
+    for stage in REQUIRED_STAGES:
+        if stage not in sections:
+            raise PromptError(f"{name}: 缺少 {stage}")
+    for stage, template in sections.items():
+        expected = STAGE_FIELDS.get(stage)
+        if expected is None:
+            continue
+        if template.fields != expected:
+            raise PromptError(
+                f"{name}/{stage}: 占位符应为 {sorted(expected)}，实际为 {sorted(template.fields)}"
+            )
+
+
+# 按文件路径缓存编译结果，(mtime, size) 不变时不再重新解析
+_compiled_cache = {}
+_cache_lock = threading.Lock()
+
+
+def load_prompt_file(path):
+    st = os.stat(path)
+    stamp = (st.st_mtime_ns, st.st_size)
+    with _cache_lock:
+        cached = _compiled_cache.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+    name = os.path.splitext(os.path.basename(path))[0]
+    with open(path, "r", encoding="utf-8") as f:
+        sections = parse_prompt(f.read(), name)
+    with _cache_lock:
+        _compiled_cache[path] = (stamp, sections)
+    return sections
+
+
+class PromptManager:
+    def __init__(self, directory="prompts"):
+        self.directory = directory
+        self._prompts = {}
+        self._lock = threading.Lock()
+        self.load_all()
+
+    def load_all(self, strict=True):
+        """加载/热更新 prompts/ 下的 .md；strict=False 时单个文件出错只记录日志并保留旧版本"""
+        prompts = {}
+        for filename in sorted(os.listdir(self.directory)):
+            if filename.endswith(".md"):
+                name = filename[:-3]
+                path = os.path.join(self.directory, filename)
+                try:
+                    prompts[name] = load_prompt_file(path)
+                except PromptError as e:
+                    if strict or name not in self._prompts:
+                        raise
+                    logger.error(f"Prompt reload failed, keeping previous version: {e}")
+                    prompts[name] = self._prompts[name]
+        with self._lock:
+            self._prompts = prompts
+
+    def refresh(self):
+        """供常驻进程在每个任务前调用，只重新解析修改过的文件"""
+        self.load_all(strict=False)
+
+    @property
+    def prompts(self):
+        return self._prompts
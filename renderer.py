@@ -0,0 +1,88 @@
+import re
+import threading
+
+import markdown
+
+MARKDOWN_EXTENSIONS = ['extra']
+
+# GitHub Pages 文章页样式；WeChat 版本由同一份样式表预编译为内联 style
+ARTICLE_CSS = """
+body { font-family: -apple-system, system-ui, BlinkMacSystemFont, "Segoe UI", Roboto, "Helvetica Neue", Arial, sans-serif; line-height: 1.6; max-width: 800px; margin: 0 auto; padding: 20px; color: #333; }
+h1 { border-bottom: 2px solid #07c160; padding-bottom: 10px; }
+.meta { color: #999; margin-bottom: 20px; }
+strong { color: #07c160; }
+blockquote { border-left: 4px solid #eee; padding-left: 20px; color: #666; font-style: italic; }
+"""
+
+# 微信编辑器会去掉 <style>，这些补充规则只用于内联
+WECHAT_EXTRA_CSS = """
+section { font-size: 16px; line-height: 1.75; color: #333; }
+h2 { font-size: 18px; color: #07c160; margin: 24px 0 12px; }
+h3 { font-size: 16px; margin: 20px 0 10px; }
+p { margin: 0 0 16px; letter-spacing: 0.5px; }
+ul, ol { padding-left: 20px; margin: 0 0 16px; }
+li { margin-bottom: 6px; }
+hr { border: none; border-top: 1px solid #eee; margin: 24px 0; }
+img { max-width: 100%; }
+"""
+
+RULE_RE = re.compile(r"([^{}]+)\{([^{}]*)\}")
+OPEN_TAG_RE = re.compile(r"<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(\s*/)?>")
+STYLE_ATTR_RE = re.compile(r'\sstyle="([^"]*)"')
+
+
+def compile_stylesheet(css):
+    """把只含标签选择器的样式表编译为 {标签: 内联 style 字符串}；类选择器等无法内联的规则被忽略"""
+    declarations = {}
+    for selectors, body in RULE_RE.findall(css):
+        # 双引号会截断 style="..." 属性，统一换成单引号
+        body = "; ".join(d.strip().replace('"', "'") for d in body.split(";") if d.strip())
+        for selector in selectors.split(","):
+            selector = selector.strip()
+            if selector.isalnum():
+                declarations.setdefault(selector, []).append(body)
+    return {tag: "; ".join(parts) + ";" for tag, parts in declarations.items()}
+
+
+WECHAT_STYLES = compile_stylesheet(ARTICLE_CSS + WECHAT_EXTRA_CSS)
+
+
+def inline_styles(html, styles=WECHAT_STYLES):
+    """一次扫描所有开始标签，把对应标签的样式写入 style 属性（已有的内联样式优先）"""
+    def apply(match):
+        tag, attrs, closing = match.group(1), (match.group(2) or "").rstrip(), match.group(3) and " /" or ""
+        style = styles.get(tag.lower())
+        if not style:
+            return match.group(0)
+        existing = STYLE_ATTR_RE.search(attrs)
+        if existing:
+            attrs = STYLE_ATTR_RE.sub("", attrs, count=1)
+            style = f"{style} {existing.group(1)}"
+        return f'<{tag}{attrs} style="{style}"{closing}>'
+    return OPEN_TAG_RE.sub(apply, html)
+
+
+_local = threading.local()
+
+
+def _converter():
+    # Markdown 实例不是线程安全的：每个线程/进程各自持有一个，重复使用时只需 reset()
+    md = getattr(_local, "md", None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=MARKDOWN_EXTENSIONS)
+    return md
+
+
+def render_markdown(text):
+    return _converter().reset().convert(text)
+
+
+def render_wechat(content_html):
+    """生成可直接提交到微信草稿的正文 HTML（全部样式内联）"""
+    return inline_styles(f"<section>{content_html}</section>")
+
+
+def render_article(text):
+    """返回 (GitHub Pages 正文 HTML, 微信正文 HTML)"""
+    html = render_markdown(text)
+    return html, render_wechat(html)
@@ -0,0 +1,147 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+from llm_client import LLMCancelled, LLMError, PROVIDERS, create_client, current_stage
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.3
+# 错误率对得分的惩罚系数：error_rate=0.5 时得分放大为 3 倍
+ERROR_PENALTY = 4.0
+COOLDOWN_BASE = 30.0
+COOLDOWN_CAP = 300.0
+
+
+class BackendStats:
+    """单个 provider:model 的滚动健康度：延迟 EWMA、最近 window 次调用的错误率和连续失败冷却"""
+
+    def __init__(self, window=20):
+        self.results = deque(maxlen=window)
+        self.latency = None
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+
+    @property
+    def error_rate(self):
+        if not self.results:
+            return 0.0
+        return self.results.count(False) / len(self.results)
+
+    def score(self):
+        # 尚无成功样本的后端排在已知健康的后端之后，按配置顺序作为备选
+        if self.latency is None:
+            return float("inf")
+        return self.latency * (1 + ERROR_PENALTY * self.error_rate)
+
+    def record(self, ok, latency):
+        self.results.append(ok)
+        if ok:
+            self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+            self.consecutive_failures = 0
+            self.cooldown_until = 0.0
+        else:
+            self.consecutive_failures += 1
+            cooldown = min(COOLDOWN_CAP, COOLDOWN_BASE * 2 ** (self.consecutive_failures - 1))
+            self.cooldown_until = time.monotonic() + cooldown
+
+
+class ProviderScheduler:
+    """在多个 LLM 后端之上路由每次阶段调用
+
+    每次调用按阶段约束筛选可用后端，按健康度排序后依次尝试，
+    失败即切换到下一个，文章流水线无需从头重来。接口与 GeminiClient / DeepSeekClient 一致。
+    """
+
+    # 并发由各后端自身的限流控制，批量模式不再按 provider 加信号量
+    provider = None
+    error_prefix = "Scheduler Error"
+
+    def __init__(self, backends, stage_backends=None, window=20):
+        self.backends = backends
+        self.stage_backends = stage_backends or {}
+        self.stats = {name: BackendStats(window) for name in backends}
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config, cache_mode="use"):
+        """按 config.json 的 scheduler 段创建，缺少 API Key 的后端会被跳过
+
+        stages 中配置了的阶段只在列出的后端上运行；某个阶段列出的后端全都不可用时抛出 ValueError，
+        而不是悄悄改用其他后端。未在 stages 中出现的阶段可用全部后端。
+        """
+        section = config.get("scheduler", {})
+        backends = {}
+        for name in section.get("backends", []):
+            provider, _, model = name.partition(":")
+            if not os.getenv(PROVIDERS[provider][1]):
+                logger.info(f"Skipping backend {name}: {PROVIDERS[provider][1]} not set")
+                continue
+            backends[name] = create_client(provider, config, model=model or None, cache_mode=cache_mode)
+        if not backends:
+            raise ValueError("No scheduler backend has an API key configured")
+        stages = {
+            stage: [n for n in names if n in backends]
+            for stage, names in section.get("stages", {}).items()
+        }
+        missing = sorted(stage for stage, names in stages.items() if not names)
+        if missing:
+            raise ValueError(f"No backend with an API key configured for: {', '.join(missing)}")
+        return cls(backends, stages, section.get("window", 20))
+
+    @property
+    def model(self):
+        return ", ".join(self.backends)
+
+    def rank(self, stage=None):
+        """返回该阶段可用后端，按得分从好到差排序；冷却中的后端排在最后
+
+        只有未配置约束的阶段才会使用全部后端。
+        """
+        names = self.stage_backends[stage] if stage in self.stage_backends else list(self.backends)
+        now = time.monotonic()
+        with self.lock:
+            order = {name: i for i, name in enumerate(names)}
+            return sorted(names, key=lambda n: (self.stats[n].cooldown_until > now, self.stats[n].score(), order[n]))
+
+    def _dispatch(self, call, strict):
+        stage = current_stage.get()
+        errors = []
+        for name in self.rank(stage):
+            start = time.monotonic()
+            try:
+                text = call(self.backends[name])
+            except LLMCancelled:
+                # 调用方主动中止，不计入后端健康度，也不切换到下一个后端
+                raise
+            except LLMError as e:
+                with self.lock:
+                    self.stats[name].record(False, time.monotonic() - start)
+                logger.warning(f"[{stage or '-'}] {name} failed ({e}), failing over")
+                errors.append(f"{name}: {e}")
+                continue
+            with self.lock:
+                self.stats[name].record(True, time.monotonic() - start)
+            logger.info(f"[{stage or '-'}] served by {name} in {time.monotonic() - start:.1f}s")
+            return text
+        message = "; ".join(errors) or "no eligible backend"
+        if strict:
+            raise LLMError(message)
+        return f"{self.error_prefix}: {message}"
+
+    def generate(self, prompt, system_instruction=None, strict=False, history=None):
+        return self._dispatch(lambda llm: llm.generate(prompt, system_instruction, True, history), strict)
+
+    def generate_to_file(self, prompt, path, system_instruction=None, strict=False, history=None, cancel=None):
+        return self._dispatch(
+            lambda llm: llm.generate_to_file(prompt, path, system_instruction, True, history, cancel), strict)
+
+    def health(self):
+        """各后端的延迟 EWMA、错误率与剩余冷却秒数，供 worker 的 /health 接口展示"""
+        with self.lock:
+            return {
+                name: {"latency": s.latency, "error_rate": s.error_rate, "cooldown": max(0.0, s.cooldown_until - time.monotonic())}
+                for name, s in self.stats.items()
+            }
@@ -0,0 +1,91 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from llm_client import LLMError, llm_stage
+
+SECTION_STAGE = "Stage 4 Section"
+ENDING_STAGE = "Stage 4 Ending"
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+\S")
+
+
+def split_sections(markdown):
+    """按小标题把正文切成若干节，并把最后一段（结尾互动/引导语）单独拆出
+
+    切分层级取至少出现两次的最高级标题，首个标题之前的导语并入第一节。
+    最后一节拆掉结尾后只剩小标题时，小标题随结尾一起交给结尾审查，不把光秃秃的标题当作一节送审。
+    返回 (sections, ending)；找不到可切分的小标题时返回 None。
+    """
+    lines = markdown.strip().split("\n")
+    levels = [len(m.group(1)) for m in map(HEADING_RE.match, lines) if m]
+    levels = [level for level in sorted(set(levels)) if levels.count(level) >= 2]
+    if not levels:
+        return None
+    marker = "#" * levels[0] + " "
+
+    sections = []
+    current = []
+    for line in lines:
+        if line.startswith(marker) and any(l.startswith(marker) for l in current):
+            sections.append("\n".join(current).strip())
+            current = []
+        current.append(line)
+    sections.append("\n".join(current).strip())
+
+    paragraphs = re.split(r"\n\s*\n", sections[-1])
+    body = "\n\n".join(paragraphs[:-1]).strip()
+    if _has_body(body):
+        sections[-1] = body
+        ending = paragraphs[-1].strip()
+    else:
+        ending = sections.pop()
+    if not sections:
+        return None
+    return sections, ending
+
+
+def _has_body(text):
+    """除小标题外是否还有正文"""
+    return any(line.strip() and not HEADING_RE.match(line) for line in text.split("\n"))
+
+
+def plan_review(prompts, content):
+    """分节审查要发出的请求: [(阶段名, prompt), ...]，最后一项是结尾；风格未提供分节模板或正文无法切分时返回 None"""
+    if SECTION_STAGE not in prompts or ENDING_STAGE not in prompts:
+        return None
+    split = split_sections(content)
+    if split is None:
+        return None
+    sections, ending = split
+    calls = [(SECTION_STAGE, prompts[SECTION_STAGE].format(section=section)) for section in sections]
+    calls.append((ENDING_STAGE, prompts[ENDING_STAGE].format(ending=ending)))
+    return calls
+
+
+def stitch(outputs):
+    """按原顺序拼回各节与结尾"""
+    for text in outputs:
+        if not text.strip():
+            raise LLMError("section review returned empty output")
+    return "\n\n".join(text.strip() for text in outputs)
+
+
+def draft_names(calls):
+    """流式审查时各请求的草稿文件名：review-01.md、review-02.md……，结尾为 review-ending.md"""
+    return [f"review-{i + 1:02d}.md" for i in range(len(calls) - 1)] + ["review-ending.md"]
+
+
+def review_sections(llm, calls, max_workers=4, paths=None):
+    """并发审查各节与结尾（结尾只依赖原文最后一段，与各节同时进行），总耗时约等于最慢的一节
+
+    给出 paths（与 calls 一一对应）时各节流式写入对应的草稿文件。
+    """
+    def review(call, path):
+        stage, prompt = call
+        with llm_stage(stage):
+            if path:
+                return llm.generate_to_file(prompt, path, strict=True)
+            return llm.generate(prompt, strict=True)
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(calls)))) as pool:
+        return stitch(list(pool.map(review, calls, paths or [None] * len(calls))))
@@ -0,0 +1,546 @@
+import argparse
+import datetime
+import email.utils
+import filecmp
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import re
+import string
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import quote
+from xml.sax.saxutils import escape
+
+from renderer import ARTICLE_CSS, render_markdown
+
+try:
+    import brotli
+except ImportError:  # 可选依赖：未安装时只生成 .gz
+    brotli = None
+
+SOURCES_DIR = "sources"
+BUILD_STATE_FILE = ".build_state.json"
+ASSETS_DIR = "assets"
+SITEMAP_FILE = "sitemap.xml"
+FEED_FILE = "feed.xml"
+# 单个 sitemap 文件的 URL 上限（sitemaps.org 协议），超出时拆分并由 sitemap.xml 作为索引
+SITEMAP_LIMIT = 50000
+COMPRESS_EXTENSIONS = (".html", ".json", ".css", ".xml")
+FEED_TZ = datetime.timezone(datetime.timedelta(hours=8))
+
+
+def minify_css(css):
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+# 所有文章页共用的样式表，文件名带内容哈希：内容不变则 URL 不变，可被浏览器与 CDN 长期缓存
+STYLESHEET_CSS = minify_css(ARTICLE_CSS)
+STYLESHEET_PATH = f"{ASSETS_DIR}/style.{hashlib.sha256(STYLESHEET_CSS.encode('utf-8')).hexdigest()[:10]}.css"
+
+ARTICLE_TEMPLATE = string.Template("""<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>$title</title>
+    <link rel="stylesheet" href="$stylesheet">
+</head>
+<body>
+    <h1>$title</h1>
+    <div class="meta">发布日期: $date_str</div>
+    $content_html
+    <hr>
+    <p><a href="index.html">← 返回首页</a></p>
+</body>
+</html>""")
+
+
+def render_article_page(title, date_str, content_html):
+    return ARTICLE_TEMPLATE.substitute(title=title, date_str=date_str, content_html=content_html,
+                                       stylesheet=STYLESHEET_PATH)
+
+
+def write_if_changed(path, text):
+    """内容与磁盘上完全一致时不写文件，返回是否写入；text 可为 str 或 bytes"""
+    data = text if isinstance(text, bytes) else text.encode("utf-8")
+    try:
+        with open(path, "rb") as f:
+            if f.read() == data:
+                return False
+    except FileNotFoundError:
+        pass
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+def _sha256(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def source_path(filename):
+    return os.path.join(SOURCES_DIR, os.path.splitext(os.path.basename(filename))[0] + ".md")
+
+
+def save_source(filename, title, date_str, markdown_text):
+    """保存文章的 Markdown 源稿（带 title/date/url 头信息），供 rebuild 重新渲染"""
+    os.makedirs(SOURCES_DIR, exist_ok=True)
+    path = source_path(filename)
+    header = json.dumps({"title": title, "date": date_str, "url": os.path.basename(filename)}, ensure_ascii=False)
+    write_if_changed(path, f"<!-- {header} -->\n{markdown_text}")
+    return path
+
+
+def load_source(path):
+    with open(path, "r", encoding="utf-8") as f:
+        first, _, body = f.read().partition("\n")
+    meta = json.loads(first[len("<!-- "):-len(" -->")])
+    return meta, body
+
+
+def _render_source(path):
+    """在工作进程中渲染一篇源稿，返回 (输出路径, HTML)"""
+    meta, body = load_source(path)
+    html = render_markdown(body)
+    return meta["url"], render_article_page(meta["title"], meta["date"], html)
+
+
+INDEX_TEMPLATE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta charset="UTF-8">
+    <title>微信文章存档</title>
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <style>
+        body { font-family: -apple-system, sans-serif; max-width: 800px; margin: 0 auto; padding: 20px; background: #f5f5f5; }
+        .container { background: white; padding: 30px; border-radius: 8px; box-shadow: 0 2px 10px rgba(0,0,0,0.1); }
+        h1 { color: #07c160; text-align: center; }
+        .controls { display: flex; gap: 10px; margin-bottom: 20px; justify-content: center; align-items: center; flex-wrap: wrap; }
+        select, input { padding: 8px; border: 1px solid #ddd; border-radius: 4px; }
+        #article-list { list-style: none; padding: 0; }
+        #article-list li { padding: 15px; border-bottom: 1px solid #eee; display: flex; justify-content: space-between; }
+        #article-list a { text-decoration: none; color: #333; font-weight: 500; }
+        #article-list a:hover { color: #07c160; }
+        .date { color: #999; font-size: 0.9em; }
+        #status { text-align: center; color: #999; font-size: 0.9em; }
+        #load-more { display: block; margin: 20px auto 0; padding: 8px 24px; border: 1px solid #07c160; color: #07c160; background: white; border-radius: 4px; cursor: pointer; }
+    </style>
+</head>
+<body>
+    <div class="container">
+        <h1>微信文章存档</h1>
+        <div class="controls">
+            <input type="text" id="search-box" placeholder="搜索文章标题...">
+            <label>按日期筛选:</label>
+            <input type="date" id="date-picker">
+            <label>或选择文章:</label>
+            <select id="article-dropdown">
+                <option value="">-- 请选择 --</option>
+            </select>
+        </div>
+        <ul id="article-list"></ul>
+        <div id="status"></div>
+        <button id="load-more" hidden>加载更多</button>
+    </div>
+
+    <script>
+        // 数据按月分片存放在 manifest/ 下，只按需加载当前页用到的分片；
+        // 搜索走预先构建的倒排索引 manifest/search/，按 gram 哈希分片，只下载查询用到的分片：
+        // 二字组合在 b<n>.json，单字在 u<n>.json（只有一个字的查询才用到），编号列表差分编码。
+        const PAGE_SIZE = 30;
+        let monthIndex = null;
+        const searchShards = {};
+        const shards = {};
+        let view = { ids: [], pos: 0, matches: () => true };
+        let renderToken = 0;
+
+        function loadShard(month) {
+            if (!shards[month]) shards[month] = fetch(`manifest/${month}.json`).then(r => r.json());
+            return shards[month];
+        }
+
+        // 与 manifest_store.gram_shard 一致：按码点计算，32 位回绕
+        function gramShard(gram) {
+            let h = 0;
+            for (const ch of gram) h = (h * 31 + ch.codePointAt(0)) >>> 0;
+            return h % monthIndex.search_shards;
+        }
+
+        function loadSearchShard(name) {
+            if (!searchShards[name]) searchShards[name] = fetch(`manifest/search/${name}.json`).then(r => r.json());
+            return searchShards[name];
+        }
+
+        async function postings(gram, kind) {
+            const deltas = (await loadSearchShard(kind + gramShard(gram)))[gram];
+            if (!deltas) return null;
+            let id = 0;
+            return deltas.map(d => (id += d));
+        }
+
+        // 由全局编号二分查找所属月份
+        function monthOf(id) {
+            const months = monthIndex.months;
+            let lo = 0, hi = months.length - 1;
+            while (lo < hi) {
+                const mid = (lo + hi + 1) >> 1;
+                if (months[mid].start <= id) lo = mid; else hi = mid - 1;
+            }
+            return months[lo];
+        }
+
+        async function getArticles(ids) {
+            const needed = [...new Set(ids.map(id => monthOf(id).month))];
+            await Promise.all(needed.map(loadShard));
+            return Promise.all(ids.map(async id => {
+                const m = monthOf(id);
+                return (await loadShard(m.month))[id - m.start];
+            }));
+        }
+
+        function range(start, count) {
+            return Array.from({ length: count }, (_, i) => start + i);
+        }
+
+        function intersect(a, b) {
+            const out = [];
+            let i = 0, j = 0;
+            while (i < a.length && j < b.length) {
+                if (a[i] === b[j]) { out.push(a[i]); i++; j++; }
+                else if (a[i] < b[j]) i++;
+                else j++;
+            }
+            return out;
+        }
+
+        async function searchIds(term) {
+            const chars = Array.from(term);
+            const grams = chars.length === 1 ? chars : chars.slice(1).map((c, i) => chars[i] + c);
+            const lists = await Promise.all([...new Set(grams)].map(g => postings(g, chars.length === 1 ? 'u' : 'b')));
+            if (lists.some(ids => !ids)) return [];
+            lists.sort((a, b) => a.length - b.length);
+            return lists.reduce(intersect);
+        }
+
+        async function renderNextPage(token) {
+            if (view.loading) return;
+            view.loading = true;
+            try {
+                await appendPage(token);
+            } finally {
+                view.loading = false;
+            }
+        }
+
+        async function appendPage(token) {
+            const list = document.getElementById('article-list');
+            const dropdown = document.getElementById('article-dropdown');
+            const fragment = document.createDocumentFragment();
+            const options = document.createDocumentFragment();
+            let shown = 0;
+            while (shown < PAGE_SIZE && view.pos < view.ids.length) {
+                const batch = view.ids.slice(view.pos, view.pos + PAGE_SIZE);
+                view.pos += batch.length;
+                const articles = await getArticles(batch);
+                if (token !== renderToken) return;
+                for (const a of articles) {
+                    if (!view.matches(a)) continue;
+                    const li = document.createElement('li');
+                    const link = document.createElement('a');
+                    link.href = a.url;
+                    link.textContent = a.title;
+                    const date = document.createElement('span');
+                    date.className = 'date';
+                    date.textContent = a.date;
+                    li.append(link, date);
+                    fragment.appendChild(li);
+                    const opt = document.createElement('option');
+                    opt.value = a.url;
+                    opt.textContent = a.title;
+                    options.appendChild(opt);
+                    shown++;
+                }
+            }
+            list.appendChild(fragment);
+            dropdown.appendChild(options);
+            const more = view.pos < view.ids.length;
+            document.getElementById('load-more').hidden = !more;
+            document.getElementById('status').textContent =
+                list.children.length === 0 ? '没有找到匹配的文章' : (more ? '' : `共 ${list.children.length} 篇`);
+        }
+
+        async function applyFilters() {
+            const token = ++renderToken;
+            const searchTerm = document.getElementById('search-box').value.trim().toLowerCase();
+            const selectedDate = document.getElementById('date-picker').value;
+
+            let ids;
+            if (selectedDate) {
+                const m = monthIndex.months.find(m => m.month === selectedDate.slice(0, 7));
+                ids = m ? range(m.start, m.count) : [];
+            } else {
+                ids = range(0, monthIndex.total);
+            }
+            if (searchTerm) ids = intersect(ids, await searchIds(searchTerm));
+            if (token !== renderToken) return;
+
+            view = {
+                ids,
+                pos: 0,
+                matches: a => (!searchTerm || a.title.toLowerCase().includes(searchTerm))
+                    && (!selectedDate || a.date === selectedDate),
+            };
+            document.getElementById('article-list').replaceChildren();
+            document.getElementById('article-dropdown').replaceChildren(new Option('-- 请选择 --', ''));
+            await renderNextPage(token);
+        }
+
+        async function init() {
+            monthIndex = await fetch('manifest/index.json').then(r => r.json());
+            await applyFilters();
+        }
+
+        let debounce = null;
+        document.getElementById('search-box').addEventListener('input', () => {
+            clearTimeout(debounce);
+            debounce = setTimeout(applyFilters, 150);
+        });
+        document.getElementById('date-picker').addEventListener('change', applyFilters);
+        document.getElementById('load-more').addEventListener('click', () => renderNextPage(renderToken));
+
+        // 滚动到底部时自动加载下一页
+        new IntersectionObserver(entries => {
+            if (entries[0].isIntersecting && !document.getElementById('load-more').hidden) {
+                renderNextPage(renderToken);
+            }
+        }).observe(document.getElementById('load-more'));
+
+        document.getElementById('article-dropdown').addEventListener('change', (e) => {
+            if (e.target.value) window.location.href = e.target.value;
+        });
+
+        init();
+    </script>
+</body>
+</html>"""
+
+
+def generate_index_html():
+    """生成带有日历和下拉菜单的门户页面"""
+    write_if_changed("index.html", INDEX_TEMPLATE)
+    return "index.html"
+
+
+def write_stylesheet():
+    """写出共享样式表并删除旧哈希版本，返回写入和删除的路径"""
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    changed = [STYLESHEET_PATH] if write_if_changed(STYLESHEET_PATH, STYLESHEET_CSS) else []
+    keep = os.path.basename(STYLESHEET_PATH)
+    for name in os.listdir(ASSETS_DIR):
+        if name.startswith("style.") and name.endswith(".css") and name != keep:
+            changed.append(f"{ASSETS_DIR}/{name}")
+            os.remove(changed[-1])
+    return changed
+
+
+# 只写一次的文件（带哈希的样式表、文章页面）用最高压缩率；
+# manifest、搜索索引、sitemap 等每次发布都会重写且随存档增大，用快速档，否则压缩耗时随篇数线性增长
+BROTLI_QUALITY = 11
+BROTLI_FAST_QUALITY = 5
+GZIP_LEVEL = 9
+GZIP_FAST_LEVEL = 6
+
+
+def _compressors(fast=False):
+    level = GZIP_FAST_LEVEL if fast else GZIP_LEVEL
+    yield ".gz", lambda data: gzip.compress(data, level, mtime=0)
+    if brotli is not None:
+        quality = BROTLI_FAST_QUALITY if fast else BROTLI_QUALITY
+        yield ".br", lambda data: brotli.compress(data, quality=quality)
+
+
+def precompress(paths, fast=False):
+    """为 HTML/JSON/CSS/XML 生成 .gz（安装了 brotli 时另有 .br）兄弟文件，返回写入和删除的路径
+
+    兄弟文件比源文件新时跳过；源文件已被删除时一并删除其压缩版本。
+    fast=True 用于每次发布都会重写的文件，以较低压缩率换取速度。
+    """
+    changed = []
+    for path in dict.fromkeys(paths):
+        if not path.endswith(COMPRESS_EXTENSIONS):
+            continue
+        data = None
+        for suffix, compress in _compressors(fast):
+            sibling = path + suffix
+            if not os.path.exists(path):
+                if os.path.exists(sibling):
+                    os.remove(sibling)
+                    changed.append(sibling)
+                continue
+            if os.path.exists(sibling) and os.path.getmtime(sibling) >= os.path.getmtime(path):
+                continue
+            if data is None:
+                with open(path, "rb") as f:
+                    data = f.read()
+            write_if_changed(sibling, compress(data))
+            changed.append(sibling)
+    return changed
+
+
+def _write_streamed(path, chunks):
+    """逐块写入临时文件，与现有文件字节相同时丢弃，返回是否写入"""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.writelines(chunks)
+    if os.path.exists(path) and filecmp.cmp(tmp, path, shallow=False):
+        os.remove(tmp)
+        return False
+    os.replace(tmp, path)
+    return True
+
+
+def _article_url(site_url, url):
+    return escape(f"{site_url.rstrip('/')}/{quote(url)}")
+
+
+def _sitemap_urls(site_url, articles, newest=None):
+    yield '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    if newest:
+        yield f"<url><loc>{escape(site_url.rstrip('/') + '/')}</loc><lastmod>{newest}</lastmod></url>\n"
+    for article in articles:
+        yield f"<url><loc>{_article_url(site_url, article['url'])}</loc><lastmod>{article['date']}</lastmod></url>\n"
+    yield "</urlset>\n"
+
+
+def write_sitemap(store, site_url):
+    """按 manifest 顺序流式写出 sitemap.xml；超过 SITEMAP_LIMIT 篇时拆成 sitemap-N.xml 并以 sitemap.xml 作索引"""
+    changed = []
+    total = len(store)
+    with store.lock:
+        articles = store.iter_sorted()
+        first = next(articles, None)
+        newest = first["date"] if first else None
+        articles = itertools.chain([first] if first else [], articles)
+        # 首个文件额外包含首页
+        if total + 1 <= SITEMAP_LIMIT:
+            parts = 0
+            if _write_streamed(SITEMAP_FILE, _sitemap_urls(site_url, articles, newest)):
+                changed.append(SITEMAP_FILE)
+        else:
+            parts = (total + SITEMAP_LIMIT) // SITEMAP_LIMIT
+            for i in range(parts):
+                path = f"sitemap-{i + 1}.xml"
+                chunk = itertools.islice(articles, SITEMAP_LIMIT - 1 if i == 0 else SITEMAP_LIMIT)
+                if _write_streamed(path, _sitemap_urls(site_url, chunk, newest if i == 0 else None)):
+                    changed.append(path)
+            index = ['<?xml version="1.0" encoding="UTF-8"?>\n'
+                     '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n']
+            index += [f"<sitemap><loc>{_article_url(site_url, f'sitemap-{i + 1}.xml')}</loc></sitemap>\n"
+                      for i in range(parts)]
+            index.append("</sitemapindex>\n")
+            if _write_streamed(SITEMAP_FILE, index):
+                changed.append(SITEMAP_FILE)
+    # 清理文章数减少后多余的分片
+    for name in os.listdir("."):
+        match = re.fullmatch(r"sitemap-(\d+)\.xml", name)
+        if match and int(match.group(1)) > parts:
+            os.remove(name)
+            changed.append(name)
+    return changed
+
+
+def _rss_date(date_str):
+    day = datetime.datetime.strptime(date_str, "%Y-%m-%d").replace(tzinfo=FEED_TZ)
+    return email.utils.format_datetime(day)
+
+
+def write_rss(store, site_url, title, limit=20):
+    """输出最新 limit 篇文章的 RSS 2.0 feed，只从 manifest 读取前 limit 条"""
+    with store.lock:
+        items = list(itertools.islice(store.iter_sorted(), limit))
+    home = escape(site_url.rstrip("/") + "/")
+    chunks = [
+        '<?xml version="1.0" encoding="UTF-8"?>\n<rss version="2.0">\n<channel>\n',
+        f"<title>{escape(title)}</title>\n<link>{home}</link>\n<description>{escape(title)}</description>\n",
+    ]
+    if items:
+        # 用最新文章的日期而不是当前时间，内容不变时文件字节也不变
+        chunks.append(f"<lastBuildDate>{_rss_date(items[0]['date'])}</lastBuildDate>\n")
+    for item in items:
+        link = _article_url(site_url, item["url"])
+        chunks.append(f"<item><title>{escape(item['title'])}</title><link>{link}</link>"
+                      f"<guid>{link}</guid><pubDate>{_rss_date(item['date'])}</pubDate></item>\n")
+    chunks.append("</channel>\n</rss>\n")
+    return [FEED_FILE] if _write_streamed(FEED_FILE, chunks) else []
+
+
+def write_feeds(store, site_url, title, feed_items=20):
+    """生成 sitemap.xml 与 feed.xml；返回写入和删除的路径"""
+    return write_sitemap(store, site_url) + write_rss(store, site_url, title, feed_items)
+
+
+def rebuild(force=False, workers=None):
+    """只重新渲染源稿或模板发生变化的页面，字节相同的文件不重写；返回实际写入的路径"""
+    try:
+        with open(BUILD_STATE_FILE, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        state = {}
+
+    template_hash = _sha256(ARTICLE_TEMPLATE.template + ARTICLE_CSS)
+    dirty = []
+    hashes = {}
+    if os.path.isdir(SOURCES_DIR):
+        for name in sorted(os.listdir(SOURCES_DIR)):
+            if not name.endswith(".md"):
+                continue
+            path = os.path.join(SOURCES_DIR, name)
+            with open(path, "r", encoding="utf-8") as f:
+                hashes[path] = _sha256(f.read())
+            entry = state.get(path, {})
+            if force or entry.get("source") != hashes[path] or entry.get("template") != template_hash:
+                dirty.append(path)
+
+    written = []
+    if dirty:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for path, (out_path, html) in zip(dirty, pool.map(_render_source, dirty, chunksize=8)):
+                if write_if_changed(out_path, html):
+                    written.append(out_path)
+                state[path] = {"source": hashes[path], "template": template_hash, "output": out_path}
+    if write_if_changed("index.html", INDEX_TEMPLATE):
+        written.append("index.html")
+    written += write_stylesheet()
+    written += precompress(written)
+
+    for path in list(state):
+        if path not in hashes:
+            del state[path]
+    write_if_changed(BUILD_STATE_FILE, json.dumps(state, ensure_ascii=False, indent=2, sort_keys=True))
+    print(f"Rebuild: 检查 {len(hashes)} 篇源稿，重新渲染 {len(dirty)} 篇，写入 {len(written)} 个文件。")
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="静态站点构建")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="增量重建文章页面与门户页")
+    rb.add_argument("--force", action="store_true", help="忽略构建状态，全部重新渲染")
+    rb.add_argument("--workers", type=int, default=None, help="渲染进程数 (默认 CPU 核数)")
+    rb.add_argument("--no-commit", action="store_true", help="只写文件，不提交 git")
+    args = parser.parse_args()
+
+    if args.command == "rebuild":
+        written = rebuild(force=args.force, workers=args.workers)
+        if written and not args.no_commit:
+            from git_publisher import commit_paths
+            commit_paths(written, f"Rebuild site ({len(written)} files)")
+
+
+if __name__ == "__main__":
+    main()
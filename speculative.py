@@ -0,0 +1,136 @@
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future
+
+from llm_client import llm_stage
+from metrics import recorder
+
+ANGLE_RE = re.compile(r"切入点\s*\d+\s*[:：]\s*(.+)")
+TITLE_RE = re.compile(r"标题\s*[A-Za-z0-9]+\s*[:：]\s*(.+)")
+BRACKETS = {"[": "]", "【": "】", "《": "》", "「": "」", "“": "”", '"': '"'}
+
+
+def _clean(text):
+    """去掉 Markdown 加粗，以及包住整段文字的括号引号（模板中的 [标题内容] 占位写法）"""
+    text = text.replace("**", "").strip()
+    while len(text) > 1 and BRACKETS.get(text[0]) == text[-1]:
+        text = text[1:-1].strip()
+    return text
+
+
+def _key(text):
+    return re.sub(r"[\W_]+", "", text.lower())
+
+
+def parse_candidates(text):
+    """从 Stage 1 输出中解析候选 [(标题, 切入点), ...]
+
+    切入点形如「概念 - 立意说明」时只取概念部分（即 Stage 2 的 {angle}），否则取整行。
+    """
+    candidates = []
+    angle = ""
+    for line in text.split("\n"):
+        line = _clean(line.lstrip(" \t*-#>"))
+        m = ANGLE_RE.search(line)
+        if m:
+            angle = _clean(re.split(r"\s+[-—–]+\s+", m.group(1), maxsplit=1)[0])
+            continue
+        m = TITLE_RE.search(line)
+        if m and angle:
+            candidates.append((_clean(m.group(1)), angle))
+    return candidates
+
+
+def pick_order(candidates):
+    """预取顺序：先取每个切入点的第一个标题，再取第二个……用户最终选中的切入点难以预料，尽量覆盖不同切入点"""
+    groups = {}
+    for index, (title, angle) in enumerate(candidates):
+        groups.setdefault(angle, []).append((index, title, angle))
+    ranked = sorted((rank, index, title, angle)
+                    for group in groups.values() for rank, (index, title, angle) in enumerate(group))
+    return [(title, angle) for _, _, title, angle in ranked]
+
+
+class OutlinePrefetcher:
+    """用户挑选标题期间，在后台为前 N 个候选流式预生成 Stage 2 大纲
+
+    选中的候选已预取时直接取用（仍在生成则等待其完成）；其余预取随即中止：尚未开始的不再发出，
+    正在生成的在下一个流式事件到达时断开连接（reasoner 的思考阶段也一样），不再为剩余输出计费。后台线程为守护线程，进程退出时不等待。
+    """
+
+    def __init__(self, llm, prompts, candidates, limit=3, conversation=None, path_for=None):
+        self.llm = llm
+        self.prompts = prompts
+        # 对话模式下大纲接在 Stage 1 的对话之后生成，与选定后正常生成的请求一致
+        self.conversation = conversation
+        # path_for(title) 给出流式草稿的落盘路径
+        self.path_for = path_for
+        self.futures = {}
+        self.cancels = {}
+        self.angles = {}
+        for title, angle in pick_order(candidates)[:limit]:
+            key = (_key(title), _key(angle))
+            if key in self.futures:
+                continue
+            self.angles.setdefault(_key(title), angle)
+            self.futures[key] = Future()
+            self.cancels[key] = threading.Event()
+            threading.Thread(target=self._run, args=(key, title, angle), name="speculate", daemon=True).start()
+
+    def _run(self, key, title, angle):
+        future = self.futures[key]
+        cancel = self.cancels[key]
+        if cancel.is_set() or not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(self._outline(title, angle, cancel))
+        except BaseException as e:
+            future.set_exception(e)
+
+    def _outline(self, title, angle, cancel):
+        prompt = self.prompts["Stage 2"].format(title=title, angle=angle)
+        system_instruction, history = None, None
+        if self.conversation:
+            system_instruction, history = self.conversation.system_instruction, self.conversation.history
+        path = self.path_for(title) if self.path_for else os.path.join("drafts", f"{_key(title)}.outline.md")
+        # 新线程不继承调用方的 contextvars，阶段名需在此重新设置
+        with llm_stage("Stage 2"):
+            return prompt, self.llm.generate_to_file(prompt, path, system_instruction, True, history, cancel)
+
+    def __len__(self):
+        return len(self.futures)
+
+    def angle_for(self, title):
+        """该标题预取时使用的切入点，供输入时作为默认值；未预取时返回空字符串"""
+        return self.angles.get(_key(title), "")
+
+    def take(self, title, angle):
+        """返回 (实际发出的 prompt, 预取的大纲) 并中止其余预取；选中的标题与切入点未预取时返回 (None, None)
+
+        输入的标题与候选可能只在标点、空格上不同，对话模式须记录实际发出的 prompt，后续阶段的前缀才与已缓存的一致。
+        预取失败时同样返回 (None, None)，由调用方按常规流程重新生成。
+        """
+        key = (_key(title), _key(angle))
+        future = self.futures.pop(key, None)
+        self.cancels.pop(key, None)
+        self.close()
+        prompt, outline = None, None
+        waited = 0.0
+        if future is not None:
+            start = time.monotonic()
+            try:
+                prompt, outline = future.result()
+            except Exception:
+                prompt, outline = None, None
+            waited = time.monotonic() - start
+        recorder.record("spec", "Stage 2 outline", prefetched=len(self.futures) + (future is not None),
+                        hit=outline is not None, seconds=round(waited, 4))
+        return prompt, outline
+
+    def close(self):
+        """中止所有未被取用的预取"""
+        for key, cancel in self.cancels.items():
+            cancel.set()
+            self.futures[key].cancel()
@@ -1,15 +1,22 @@
 import os
 import re
-import markdown
 import time
+import datetime
+import argparse
 from dotenv import load_dotenv
-from llm_client import DeepSeekClient
-from main import PromptManager, deploy_to_github
+from llm_client import create_client
+from renderer import render_markdown
+from metrics import recorder
+from main import PromptManager, deploy_to_github, load_config, add_cache_arguments, add_profile_argument
 
 load_dotenv()
 
 def run_test():
-    api_key = os.getenv("DEEPSEEK_API_KEY")
+    parser = argparse.ArgumentParser()
+    add_cache_arguments(parser)
+    add_profile_argument(parser)
+    args = parser.parse_args()
+
     selected_model = "deepseek-reasoner"
     selected_style = "psychology"
     
@@ -18,7 +25,7 @@ def run_test():
     
     print(f"--- 启动自动化测试 (Model: {selected_model}, Style: {selected_style}) ---")
     
-    llm = DeepSeekClient(api_key, model=selected_model)
+    llm = create_client("deepseek", load_config(), model=selected_model, cache_mode=args.cache_mode)
     pm = PromptManager()
     prompts = pm.prompts[selected_style]
 
@@ -41,7 +48,7 @@ def run_test():
     print("润色已完成。")
 
     # Format & Export
-    html_content = markdown.markdown(final_article_md, extensions=['extra'])
+    html_content = render_markdown(final_article_md)
     os.makedirs("output", exist_ok=True)
     clean_title = re.sub(r'[\/:*?"<>|]', '_', selected_title)
     filename = f"output/{clean_title}.html"
@@ -50,7 +57,10 @@ def run_test():
     print(f"本地文件已生成: {filename}")
 
     # Deploy
-    deploy_to_github(f"{clean_title}.html", html_content)
+    date_str = datetime.datetime.now().strftime("%Y-%m-%d")
+    deploy_to_github(f"{clean_title}.html", html_content, selected_title, date_str, source_md=final_article_md)
+    if args.profile:
+        print(recorder.summary())
 
 if __name__ == "__main__":
     run_test()
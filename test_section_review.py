@@ -0,0 +1,41 @@
+from section_review import draft_names, review_sections, split_sections
+
+
+def test_split_sections():
+    sections, ending = split_sections("导语\n\n## A\n\na1\n\na2\n\n## B\n\nb1\n\n结尾一段")
+    assert sections == ["导语\n\n## A\n\na1\n\na2", "## B\n\nb1"]
+    assert ending == "结尾一段"
+
+
+def test_heading_only_last_section_stays_with_ending():
+    """最后一节只有小标题和一段时，不把光秃秃的小标题当作一节送审"""
+    assert split_sections("## A\n\na1\n\n## B\n\n结尾一段") == (["## A\n\na1"], "## B\n\n结尾一段")
+
+
+def test_no_headings():
+    assert split_sections("第一段\n\n第二段") is None
+    assert split_sections("## A\n\n只有一节") is None
+
+
+class FakeLLM:
+    def __init__(self):
+        self.streamed = []
+
+    def generate(self, prompt, strict=False):
+        return prompt
+
+    def generate_to_file(self, prompt, path, strict=False):
+        self.streamed.append(path)
+        return prompt
+
+
+def test_review_streams_to_drafts():
+    """给出草稿路径时各节与结尾都流式写入各自的文件"""
+    calls = [("Stage 4 Section", "## A\n\na1"), ("Stage 4 Section", "## B\n\nb1"), ("Stage 4 Ending", "结尾")]
+    assert draft_names(calls) == ["review-01.md", "review-02.md", "review-ending.md"]
+    llm = FakeLLM()
+    review_sections(llm, calls, paths=draft_names(calls))
+    assert sorted(llm.streamed) == ["review-01.md", "review-02.md", "review-ending.md"]
+    llm = FakeLLM()
+    review_sections(llm, calls)
+    assert llm.streamed == []
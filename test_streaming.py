@@ -0,0 +1,47 @@
+import threading
+import time
+
+import pytest
+
+from llm_client import DeepSeekClient, LLMCancelled
+from mock_server import MockConfig, MockServer
+
+
+def test_cancel_during_reasoning(tmp_path):
+    """reasoner 思考阶段只有 reasoning_content、没有正文块，取消后也应立即断开，而不是等到思考结束"""
+    # 200 个思考块 × 0.02 秒：完整的思考阶段约 4 秒
+    config = MockConfig(latency=0, chunk_delay=0.02, reasoning=200)
+    with MockServer(config) as server:
+        client = DeepSeekClient("test-key", "deepseek-reasoner", base_url=server.url, max_retries=0)
+        cancel = threading.Event()
+        timer = threading.Timer(0.3, cancel.set)
+        timer.start()
+        start = time.monotonic()
+        with pytest.raises(LLMCancelled):
+            client.generate_to_file("prompt", str(tmp_path / "outline.md"), strict=True, cancel=cancel)
+        timer.cancel()
+        assert time.monotonic() - start < 1.0
+        assert (tmp_path / "outline.md").read_text(encoding="utf-8") == ""
+
+
+def test_cancel_before_request(tmp_path):
+    """已被取消的预取不再发出请求"""
+    config = MockConfig(latency=0, chunk_delay=0)
+    with MockServer(config) as server:
+        client = DeepSeekClient("test-key", "deepseek-reasoner", base_url=server.url, max_retries=0)
+        cancel = threading.Event()
+        cancel.set()
+        with pytest.raises(LLMCancelled):
+            client.generate_to_file("prompt", str(tmp_path / "outline.md"), strict=True, cancel=cancel)
+        assert config.requests == 0
+
+
+def test_stream_completes_through_reasoning(tmp_path):
+    """未取消时思考过程不写入草稿，正文完整返回"""
+    config = MockConfig(latency=0, chunk_delay=0, chunks=3, reasoning=20)
+    with MockServer(config) as server:
+        client = DeepSeekClient("test-key", "deepseek-reasoner", base_url=server.url, max_retries=0)
+        path = tmp_path / "outline.md"
+        text = client.generate_to_file("prompt", str(path), strict=True, cancel=threading.Event())
+        assert text == path.read_text(encoding="utf-8")
+        assert "思考中" not in text and text.count("## 小标题") == 3
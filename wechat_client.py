@@ -1,40 +1,257 @@
 import requests
+import hashlib
 import json
 import logging
+import mimetypes
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: 退化为进程内锁
+    fcntl = None
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-class WeChatClient:
-    def __init__(self, app_id, app_secret):
+WECHAT_BASE_URL = os.getenv("WECHAT_BASE_URL", "https://api.weixin.qq.com")
+TOKEN_CACHE_FILE = ".wechat_token.json"
+# 提前多久刷新 token（秒）；微信在新 token 下发后旧 token 仍有约 5 分钟有效期
+REFRESH_MARGIN = 300
+# access_token 失效相关的错误码
+TOKEN_ERRCODES = {40001, 40014, 42001}
+# 单个草稿最多包含的图文数
+MAX_ARTICLES_PER_DRAFT = 8
+IMAGE_CACHE_FILE = ".wechat_images.json"
+IMAGE_UPLOAD_WORKERS = 8
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\bsrc=)(["\'])([^"\']+)\2', re.IGNORECASE)
+
+
+class TokenCache:
+    """多进程共享的 access_token 缓存
+
+    token 与过期时间持久化在磁盘上，刷新时持有文件锁并重新读取，
+    保证所有 worker 共用同一个 token，/cgi-bin/token 只被调用一次。
+    """
+
+    def __init__(self, app_id, app_secret, path=TOKEN_CACHE_FILE, margin=REFRESH_MARGIN, base_url=None):
         self.app_id = app_id
         self.app_secret = app_secret
-        self.access_token = None
+        self.base_url = base_url or WECHAT_BASE_URL
+        self.path = path
+        self.margin = margin
+        self._entry = None
+        self._thread_lock = threading.Lock()
+        self._refresher = None
 
-    def get_access_token(self):
-        """获取微信 Access Token"""
-        url = f"https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={self.app_id}&secret={self.app_secret}"
-        response = requests.get(url)
-        data = response.json()
-        if "access_token" in data:
-            self.access_token = data["access_token"]
-            logger.info("Successfully obtained Access Token")
-            return self.access_token
-        else:
+    def _fresh(self, entry):
+        return bool(entry) and time.time() < entry["expires_at"] - self.margin
+
+    def _read(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f).get(self.app_id)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, entry):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        data[self.app_id] = entry
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def _locked(self):
+        with self._thread_lock:
+            if fcntl is None:
+                yield
+                return
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _fetch(self):
+        url = f"{self.base_url}/cgi-bin/token?grant_type=client_credential&appid={self.app_id}&secret={self.app_secret}"
+        data = requests.get(url, timeout=10).json()
+        if "access_token" not in data:
             logger.error(f"Failed to get Access Token: {data}")
             raise Exception(f"WeChat Auth Failed: {data}")
+        logger.info("Successfully obtained Access Token")
+        return {"access_token": data["access_token"], "expires_at": time.time() + int(data.get("expires_in", 7200))}
 
-    def upload_draft(self, title, content, author="", digest="", content_source_url="", thumb_media_id=""):
-        """
-        新建草稿
-        thumb_media_id: 图文消息的封面图片素材id（必须有）
-        """
-        if not self.access_token:
-            self.get_access_token()
+    def get(self, stale_token=None):
+        """返回有效的 token；stale_token 为刚被微信判定失效的 token，只有缓存里仍是它时才强制刷新"""
+        entry = self._entry
+        if self._fresh(entry) and entry["access_token"] != stale_token:
+            return entry["access_token"]
+        entry = self._read()
+        if self._fresh(entry) and entry["access_token"] != stale_token:
+            self._entry = entry
+            return entry["access_token"]
+        with self._locked():
+            # 等锁期间可能已有其他进程刷新过
+            entry = self._read()
+            if not (self._fresh(entry) and entry["access_token"] != stale_token):
+                entry = self._fetch()
+                self._write(entry)
+            self._entry = entry
+            return entry["access_token"]
+
+    def start_auto_refresh(self):
+        """后台线程在过期前 margin 秒主动刷新，上传草稿时无需等待鉴权请求"""
+        if self._refresher and self._refresher.is_alive():
+            return
+        self._refresher = threading.Thread(target=self._refresh_loop, name="wechat-token-refresh", daemon=True)
+        self._refresher.start()
+
+    def _refresh_loop(self):
+        while True:
+            try:
+                self.get()
+                delay = self._entry["expires_at"] - self.margin - time.time()
+            except Exception as e:
+                logger.error(f"Background token refresh failed: {e}")
+                delay = 60
+            time.sleep(max(delay, 1))
+
+
+class WeChatClient:
+    def __init__(self, app_id, app_secret, token_cache=None, auto_refresh=False, image_cache_path=IMAGE_CACHE_FILE,
+                 base_url=None):
+        self.app_id = app_id
+        self.app_secret = app_secret
+        self.access_token = None
+        self.base_url = base_url or WECHAT_BASE_URL
+        self.tokens = token_cache or TokenCache(app_id, app_secret, base_url=self.base_url)
+        if auto_refresh:
+            self.tokens.start_auto_refresh()
+        # 图片内容 sha256 -> 微信图片 URL，跨次运行复用，同一张图只上传一次
+        self.image_cache_path = image_cache_path
+        self._image_urls = self._load_image_cache()
+        self._image_lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, **kwargs):
+        """使用环境变量 WECHAT_APP_ID / WECHAT_APP_SECRET 创建客户端"""
+        return cls(os.getenv("WECHAT_APP_ID"), os.getenv("WECHAT_APP_SECRET"), **kwargs)
+
+    def get_access_token(self, stale_token=None):
+        """获取微信 Access Token（优先使用磁盘缓存）"""
+        self.access_token = self.tokens.get(stale_token)
+        return self.access_token
 
-        url = f"https://api.weixin.qq.com/cgi-bin/draft/add?access_token={self.access_token}"
-        
-        article = {
+    def _call(self, path, **kwargs):
+        """带 access_token 调用接口；token 被判定失效时刷新并重试一次"""
+        token = self.get_access_token()
+        for attempt in range(2):
+            url = f"{self.base_url}{path}?access_token={token}"
+            result = requests.post(url, timeout=30, **kwargs).json()
+            if result.get("errcode") in TOKEN_ERRCODES and attempt == 0:
+                logger.warning(f"Access Token rejected ({result.get('errcode')}), refreshing")
+                token = self.get_access_token(stale_token=token)
+                continue
+            return result
+
+    def _post_json(self, path, payload):
+        # 微信接口要求中文字符不转义
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        return self._call(path, data=data)
+
+    def _load_image_cache(self):
+        try:
+            with open(self.image_cache_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_image_cache(self):
+        with self._image_lock:
+            data = dict(self._image_urls)
+        tmp = f"{self.image_cache_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        os.replace(tmp, self.image_cache_path)
+
+    def upload_image(self, data, filename="image.jpg"):
+        """上传正文图片（/cgi-bin/media/uploadimg），返回微信图片 URL"""
+        digest = hashlib.sha256(data).hexdigest()
+        with self._image_lock:
+            if digest in self._image_urls:
+                return self._image_urls[digest]
+        content_type = mimetypes.guess_type(filename)[0] or "image/jpeg"
+        result = self._call("/cgi-bin/media/uploadimg", files={"media": (filename, data, content_type)})
+        if not result.get("url"):
+            logger.error(f"Failed to upload image {filename}: {result}")
+            return None
+        with self._image_lock:
+            self._image_urls[digest] = result["url"]
+        return result["url"]
+
+    @staticmethod
+    def _read_image(src, base_dir):
+        if src.startswith(("http://", "https://")):
+            response = requests.get(src, timeout=30)
+            response.raise_for_status()
+            return response.content
+        with open(os.path.join(base_dir, src), "rb") as f:
+            return f.read()
+
+    def localize_images(self, contents, base_dir="."):
+        """把一组 HTML 正文中的图片并发上传到微信并替换 src；相同内容的图片只上传一次"""
+        sources = []
+        for html in contents:
+            for _, _, src in IMG_SRC_RE.findall(html):
+                if "mmbiz.qpic.cn" not in src and src not in sources:
+                    sources.append(src)
+        if not sources:
+            return list(contents)
+
+        def fetch(src):
+            try:
+                return src, self._read_image(src, base_dir)
+            except (OSError, requests.RequestException) as e:
+                logger.error(f"Failed to read image {src}: {e}")
+                return src, None
+
+        with ThreadPoolExecutor(max_workers=IMAGE_UPLOAD_WORKERS) as pool:
+            blobs = {src: data for src, data in pool.map(fetch, sources) if data is not None}
+            by_hash = {}
+            for src, data in blobs.items():
+                by_hash.setdefault(hashlib.sha256(data).hexdigest(), (src, data))
+            uploaded = dict(zip(by_hash, pool.map(
+                lambda item: self.upload_image(item[1], os.path.basename(item[0].split("?")[0])),
+                by_hash.values(),
+            )))
+        self._save_image_cache()
+
+        url_map = {}
+        for src, data in blobs.items():
+            url = uploaded.get(hashlib.sha256(data).hexdigest())
+            if url:
+                url_map[src] = url
+        logger.info(f"Uploaded {len(by_hash)} unique images for {len(sources)} sources")
+        return [
+            IMG_SRC_RE.sub(lambda m: f"{m.group(1)}{m.group(2)}{url_map.get(m.group(3), m.group(3))}{m.group(2)}", html)
+            for html in contents
+        ]
+
+    @staticmethod
+    def build_article(title, content, author="", digest="", content_source_url="", thumb_media_id=""):
+        return {
             "title": title,
             "author": author,
             "digest": digest,
@@ -44,19 +261,31 @@ class WeChatClient:
             "need_open_comment": 1,
             "only_fans_can_comment": 0
         }
-        
-        payload = {
-            "articles": [article]
-        }
-        
-        # 微信接口要求中文字符不转义
-        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
-        response = requests.post(url, data=data)
-        result = response.json()
-        
-        if result.get("media_id"):
-            logger.info(f"Draft uploaded successfully. Media ID: {result['media_id']}")
-            return result["media_id"]
-        else:
-            logger.error(f"Failed to upload draft: {result}")
-            return None
+
+    def upload_drafts(self, articles, per_draft=MAX_ARTICLES_PER_DRAFT, base_dir="."):
+        """批量新建草稿：先并发上传所有正文图片，再按每个草稿最多 per_draft 篇分组提交
+
+        articles: build_article() 生成的字典列表；返回与分组一一对应的 media_id 列表（失败为 None）
+        """
+        contents = self.localize_images([a["content"] for a in articles], base_dir)
+        articles = [dict(a, content=c) for a, c in zip(articles, contents)]
+
+        media_ids = []
+        for start in range(0, len(articles), per_draft):
+            group = articles[start:start + per_draft]
+            result = self._post_json("/cgi-bin/draft/add", {"articles": group})
+            if result.get("media_id"):
+                logger.info(f"Draft with {len(group)} articles uploaded. Media ID: {result['media_id']}")
+                media_ids.append(result["media_id"])
+            else:
+                logger.error(f"Failed to upload draft: {result}")
+                media_ids.append(None)
+        return media_ids
+
+    def upload_draft(self, title, content, author="", digest="", content_source_url="", thumb_media_id=""):
+        """
+        新建草稿
+        thumb_media_id: 图文消息的封面图片素材id（必须有）
+        """
+        article = self.build_article(title, content, author, digest, content_source_url, thumb_media_id)
+        return self.upload_drafts([article])[0]
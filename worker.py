@@ -0,0 +1,404 @@
+"""常驻 worker：提示词、HTTP 连接池、微信 token 与 Markdown 渲染器在进程内保持热状态，通过本地 HTTP 接口接收任务
+
+    python worker.py serve [--provider deepseek] [--workers 2] [--wechat-draft] [--resume]
+    python worker.py submit --title "..." --angle "..." [--style psychology]   # 提交并实时输出进度
+    python worker.py resume JOB_ID
+    python worker.py status [JOB_ID]
+
+客户端只依赖标准库，不导入 main / markdown / requests，每篇文章省去完整的 Python 启动与冷连接开销。
+任务状态仍保存在 jobs.db，worker 重启后可用 serve --resume 继续未完成的任务。
+"""
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from job_store import WECHAT_MEDIA_ID, WECHAT_REQUESTED, finished
+
+DEFAULT_ADDRESS = os.getenv("WECHATOA_WORKER", "127.0.0.1:8765")
+TERMINAL_EVENTS = ("done", "failed")
+
+
+class JobEvents:
+    """各任务的进度事件，供 /jobs/<id>/events 长连接按顺序读取"""
+
+    def __init__(self):
+        self.events = {}
+        self.cond = threading.Condition()
+
+    def reset(self, job_id):
+        """任务重新入队时清空上一次运行的事件"""
+        with self.cond:
+            self.events[job_id] = []
+
+    def emit(self, job_id, kind, message=""):
+        with self.cond:
+            self.events.setdefault(job_id, []).append({"ts": round(time.time(), 3), "event": kind, "message": message})
+            self.cond.notify_all()
+
+    def wait(self, job_id, start, timeout=15):
+        """返回 start 之后的新事件；超时仍无新事件时返回空列表（调用方据此发送心跳）"""
+        with self.cond:
+            self.cond.wait_for(lambda: len(self.events.get(job_id, ())) > start, timeout)
+            return self.events.get(job_id, [])[start:]
+
+
+class Worker:
+    """在进程内复用 PromptManager、LLM 客户端、WeChatClient 与渲染器，逐个执行队列中的任务"""
+
+    def __init__(self, provider="deepseek", cache_mode="use", workers=1, section_review=False, wechat_draft=False,
+                 conversation=False):
+        from cli_generate import create_llm, review_workers
+        from main import PromptManager, check_duplicate, get_job_store, load_config
+        from wechat_client import WeChatClient
+
+        self.config = load_config()
+        self.pm = PromptManager()
+        self.llm = create_llm(provider, self.config, cache_mode)
+        self.max_workers = review_workers(self.config, self.llm)
+        self.store = get_job_store()
+        self.check_duplicate = check_duplicate
+        self.section_review = section_review
+        self.conversation = conversation
+        # 后台线程在 token 过期前主动刷新，上传草稿时无需等待鉴权
+        self.wechat = WeChatClient.from_env(auto_refresh=True) if wechat_draft else None
+        self.workers = workers
+        self.queue = queue.Queue()
+        # 已排队或正在运行的任务：同一任务不会被两个线程同时推进
+        self.active = set()
+        self.active_lock = threading.Lock()
+        self.events = JobEvents()
+        self.deploy_lock = threading.Lock()
+        # 查重索引是进程内单例，同时提交的请求依次同步、查询
+        self.dedup_lock = threading.Lock()
+
+    def start(self):
+        for i in range(self.workers):
+            threading.Thread(target=self._loop, name=f"worker-{i}", daemon=True).start()
+
+    def submit(self, spec):
+        """登记新任务并入队；参数不合法时抛出 ValueError"""
+        if not spec.get("title") or not spec.get("angle"):
+            raise ValueError("title 和 angle 为必填项")
+        style = spec.get("style") or "psychology"
+        if style not in self.pm.prompts:
+            raise ValueError(f"Style {style} not found.")
+        matches = []
+        if not spec.get("allow_duplicate"):
+            with self.dedup_lock:
+                level, matches = self.check_duplicate(spec["title"], spec["angle"])
+            if level == "skip":
+                similarity, title, url = matches[0]
+                raise ValueError(f"选题与已发布文章重复 ({similarity:.2f}): {title} ({url})")
+        job = self.store.create(spec["title"], spec["angle"], style, spec.get("date") or "",
+                                spec.get("keep_existing", True))
+        self.enqueue(job["id"], [f"[查重] 与已发布文章相似 ({similarity:.2f}): {title} ({url})"
+                                 for similarity, title, url in matches])
+        return job
+
+    def enqueue(self, job_id, notes=()):
+        """任务入队；已在排队或运行中时不重复入队（也不清空其事件流），返回 False"""
+        with self.active_lock:
+            if job_id in self.active:
+                return False
+            self.active.add(job_id)
+        self.events.reset(job_id)
+        self.events.emit(job_id, "queued", f"任务 #{job_id} 已排队 (前面还有 {self.queue.qsize()} 个)")
+        for note in notes:
+            self.events.emit(job_id, "progress", note)
+        self.queue.put(job_id)
+        return True
+
+    def _loop(self):
+        from renderer import render_markdown
+        # 渲染器按线程缓存，先在本线程初始化一次
+        render_markdown("")
+        while True:
+            job_id = self.queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                with self.active_lock:
+                    self.active.discard(job_id)
+                self.queue.task_done()
+
+    def _run(self, job_id):
+        from cli_generate import run_job
+        # 提示词文件改动后无需重启 worker，只重新解析修改过的文件
+        self.pm.refresh()
+        job = self.store.get(job_id)
+        self.events.emit(job_id, "started", f"开始处理: {job['title']} ({job['state']})")
+        if self.wechat and WECHAT_REQUESTED not in job["outputs"]:
+            # 部署后、上传前中断时，serve --resume 据此补传
+            self.store.save_output(job_id, WECHAT_REQUESTED, "1")
+        try:
+            job = run_job(self.store, job, self.llm, self.pm.prompts[job["style"]],
+                          section_review=self.section_review, max_workers=self.max_workers,
+                          log=lambda message: self.events.emit(job_id, "progress", message.strip()),
+                          deploy_lock=self.deploy_lock, conversation=self.conversation)
+            if self.wechat and WECHAT_MEDIA_ID not in job["outputs"]:
+                self.events.emit(job_id, "progress", "正在上传公众号草稿...")
+                media_id = self.wechat.upload_draft(job["title"], job["outputs"]["wechat_html"],
+                                                    thumb_media_id=os.getenv("WECHAT_THUMB_MEDIA_ID", ""))
+                if media_id:
+                    self.store.save_output(job_id, WECHAT_MEDIA_ID, media_id)
+        except Exception as e:
+            self.store.fail(job_id, e)
+            self.events.emit(job_id, "failed", str(e))
+            return
+        self.events.emit(job_id, "done", f"任务完成: {job['title']}")
+
+    def job_summary(self, job_id):
+        job = self.store.get(job_id)
+        if job is None:
+            return None
+        outputs = job.pop("outputs")
+        job["outputs"] = sorted(outputs)
+        return job
+
+
+class WorkerHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def worker(self):
+        return self.server.worker
+
+    def _json(self, data, status=200):
+        body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _job_id(self, parts):
+        try:
+            return int(parts[1])
+        except (IndexError, ValueError):
+            return None
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["health"]:
+            health = {"ok": True, "pid": os.getpid(), "queued": self.worker.queue.qsize()}
+            # --provider auto 时附上各后端的延迟、错误率与剩余冷却时间
+            if hasattr(self.worker.llm, "health"):
+                health["backends"] = self.worker.llm.health()
+            return self._json(health)
+        if parts == ["jobs"]:
+            return self._json(self.worker.store.recent())
+        job_id = self._job_id(parts)
+        if parts[0] != "jobs" or job_id is None:
+            return self._json({"error": "not found"}, 404)
+        job = self.worker.job_summary(job_id)
+        if job is None:
+            return self._json({"error": f"job {job_id} not found"}, 404)
+        if parts[2:] == ["events"]:
+            return self._stream_events(job)
+        self._json(job)
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            spec = json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return self._json({"error": "invalid JSON"}, 400)
+        if parts == ["jobs"]:
+            try:
+                job = self.worker.submit(spec)
+            except ValueError as e:
+                return self._json({"error": str(e)}, 400)
+            return self._json({"id": job["id"], "state": job["state"]}, 201)
+        job_id = self._job_id(parts)
+        if parts[0] == "jobs" and job_id is not None and parts[2:] == ["resume"]:
+            job = self.worker.store.get(job_id)
+            if job is None:
+                return self._json({"error": f"job {job_id} not found"}, 404)
+            # 已在排队或运行中的任务只返回当前状态，客户端照常跟随其事件流
+            queued = not finished(job) and self.worker.enqueue(job_id)
+            return self._json({"id": job_id, "state": job["state"], "queued": queued})
+        self._json({"error": "not found"}, 404)
+
+    def _stream_events(self, job):
+        """以 NDJSON 分块输出进度，直到任务完成或失败；空闲时每 15 秒发送一次心跳"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(event):
+            data = (json.dumps(event, ensure_ascii=False) + "\n").encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        job_id = job["id"]
+        if job_id not in self.worker.events.events:
+            # 本进程之外创建或已结束的任务：直接给出最终状态
+            kind = "done" if job["state"] == "deployed" else "failed"
+            send({"event": kind, "message": job["error"] or f"state: {job['state']}"})
+        else:
+            seen = 0
+            try:
+                while True:
+                    events = self.worker.events.wait(job_id, seen)
+                    if not events:
+                        send({"event": "heartbeat"})
+                        continue
+                    for event in events:
+                        send(event)
+                    seen += len(events)
+                    if events[-1]["event"] in TERMINAL_EVENTS:
+                        break
+            except (BrokenPipeError, ConnectionResetError):
+                return
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def serve(args):
+    from metrics import recorder
+    host, _, port = args.listen.rpartition(":")
+    try:
+        worker = Worker(args.provider, args.cache_mode, args.workers, args.section_review, args.wechat_draft,
+                        args.conversation)
+    except ValueError as e:
+        print(f"Error: {e}")
+        return 1
+    worker.start()
+    if args.resume:
+        for job in worker.store.unfinished():
+            if worker.enqueue(job["id"]):
+                print(f"继续任务 #{job['id']} ({job['state']}): {job['title']}")
+    httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), WorkerHandler)
+    httpd.daemon_threads = True
+    httpd.worker = worker
+    print(f"--- Worker 已启动: http://{args.listen} (Provider: {args.provider}, {worker.llm.model}) ---")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+        if args.profile:
+            print(recorder.summary())
+    return 0
+
+
+def _request(server, path, payload=None):
+    data = None if payload is None else json.dumps(payload).encode("utf-8")
+    req = urllib.request.Request(f"http://{server}{path}", data=data, headers={"Content-Type": "application/json"})
+    try:
+        return urllib.request.urlopen(req, timeout=None)
+    except urllib.error.HTTPError as e:
+        raise SystemExit(f"Error: {json.loads(e.read() or b'{}').get('error', e.code)}")
+    except urllib.error.URLError as e:
+        raise SystemExit(f"Error: 无法连接 worker {server} ({e.reason})，请先运行 python worker.py serve")
+
+
+def follow(server, job_id):
+    """输出任务进度直到结束；成功返回 0，失败返回 1"""
+    with _request(server, f"/jobs/{job_id}/events") as resp:
+        for line in resp:
+            event = json.loads(line)
+            if event["event"] == "heartbeat":
+                continue
+            print(event.get("message") or event["event"], flush=True)
+            if event["event"] in TERMINAL_EVENTS:
+                return 0 if event["event"] == "done" else 1
+    return 1
+
+
+def submit(args):
+    spec = {"title": args.title, "angle": args.angle, "style": args.style, "date": args.date,
+            "keep_existing": args.keep_existing, "allow_duplicate": args.allow_duplicate}
+    with _request(args.server, "/jobs", spec) as resp:
+        job = json.load(resp)
+    print(f"--- 已提交任务 #{job['id']}: {args.title} ---")
+    if args.detach:
+        return 0
+    return follow(args.server, job["id"])
+
+
+def resume(args):
+    with _request(args.server, f"/jobs/{args.job_id}/resume", {}) as resp:
+        job = json.load(resp)
+    # 已部署但公众号草稿未上传的任务仍会入队补传
+    if job["state"] == "deployed" and not job.get("queued"):
+        print(f"任务 #{job['id']} 已部署，无需继续。")
+        return 0
+    if job.get("queued"):
+        print(f"--- 继续任务 #{job['id']} ({job['state']}) ---")
+    else:
+        print(f"--- 任务 #{job['id']} 已在排队或运行中 ({job['state']})，跟随其进度 ---")
+    return follow(args.server, job["id"])
+
+
+def status(args):
+    if args.job_id is None:
+        with _request(args.server, "/jobs") as resp:
+            for job in json.load(resp):
+                error = f"  ({job['error'][:80]})" if job["error"] else ""
+                print(f"#{job['id']:<5} {job['state']:<9} {job['style']:<12} {job['title']}{error}")
+        with _request(args.server, "/health") as resp:
+            backends = json.load(resp).get("backends", {})
+        for name, s in backends.items():
+            latency = f"{s['latency']:.1f}s" if s["latency"] is not None else "-"
+            cooldown = f"，冷却 {s['cooldown']:.0f}s" if s["cooldown"] else ""
+            print(f"[后端] {name}: 延迟 {latency}，错误率 {s['error_rate']:.0%}{cooldown}")
+        return 0
+    with _request(args.server, f"/jobs/{args.job_id}") as resp:
+        print(json.dumps(json.load(resp), ensure_ascii=False, indent=2))
+    return 0
+
+
+def main():
+    from main import add_cache_arguments, add_conversation_argument
+    parser = argparse.ArgumentParser(description="常驻 worker 与轻量客户端")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("serve", help="启动常驻 worker")
+    p.add_argument("--listen", default=DEFAULT_ADDRESS, help="监听地址，默认 127.0.0.1:8765")
+    p.add_argument("--provider", choices=["deepseek", "gemini", "auto"], default="deepseek")
+    p.add_argument("--workers", type=int, default=1, help="同时处理的任务数（部署始终串行）")
+    p.add_argument("--section-review", action="store_true", help="Stage 4 按小标题拆分并发审查")
+    add_conversation_argument(p)
+    p.add_argument("--wechat-draft", action="store_true", help="完成后上传公众号草稿")
+    p.add_argument("--resume", action="store_true", help="启动时继续 jobs.db 中未完成的任务")
+    add_cache_arguments(p)
+    p.add_argument("--profile", action="store_true", help="退出时打印各阶段耗时与 token 汇总")
+
+    p = sub.add_parser("submit", help="提交任务并输出进度")
+    p.add_argument("--title", required=True)
+    p.add_argument("--angle", required=True)
+    p.add_argument("--style", default="psychology")
+    p.add_argument("--date", default="")
+    p.add_argument("--no-keep", action="store_false", dest="keep_existing")
+    p.add_argument("--allow-duplicate", action="store_true", help="跳过与已发布文章的查重")
+    p.add_argument("--detach", action="store_true", help="只提交，不等待完成")
+    p.add_argument("--server", default=DEFAULT_ADDRESS, help="worker 地址，默认 127.0.0.1:8765")
+
+    p = sub.add_parser("resume", help="让 worker 从最后完成的步骤继续某个任务")
+    p.add_argument("job_id", type=int)
+    p.add_argument("--server", default=DEFAULT_ADDRESS, help="worker 地址，默认 127.0.0.1:8765")
+
+    p = sub.add_parser("status", help="查看任务状态")
+    p.add_argument("job_id", nargs="?", type=int)
+    p.add_argument("--server", default=DEFAULT_ADDRESS, help="worker 地址，默认 127.0.0.1:8765")
+
+    args = parser.parse_args()
+    handlers = {"serve": serve, "submit": submit, "resume": resume, "status": status}
+    sys.exit(handlers[args.command](args))
+
+
+if __name__ == "__main__":
+    main()